@@ -47,6 +47,10 @@ urllib3.disable_warnings(category=InsecureRequestWarning)
 import argparse
 import ipaddress
 
+from iana_asn import classify_paths
+from route_snapshots import record_snapshot, load_state, summarize_changes, print_changes
+from route_table import RouteTable
+
 # === CONSTANTS ===
 
 bogon_networks = [
@@ -162,10 +166,10 @@ def get_received_prefixes(router, api_key, neighbor_ip, verify_ssl):
             return r.json().get("data", "")
     except Exception:
         pass
-    return ""
+    return None  # fetch failed, as opposed to a neighbor sending no routes
 
 def parse_received_routes(route_output):
-    prefixes = []
+    prefixes = RouteTable()
     for line in route_output.splitlines():
         line = line.strip()
         if not line or line.startswith("Network") or line.startswith("BGP") or "Next Hop" in line:
@@ -189,9 +193,11 @@ def parse_received_routes(route_output):
                     if not seen_zero_weight:
                         seen_zero_weight = (val == 0)
                         continue
+                    if val == 0 and not path:
+                        continue  # MED and weight both 0; AS0 never leads a real path (RFC7607)
                     path.append(val)
 
-            prefixes.append((prefix, path))
+            prefixes.add(prefix, path)
         except Exception:
             continue
 
@@ -222,6 +228,8 @@ def main():
     parser.add_argument("-i", "--include", type=int, help="Only include this ASN")
     parser.add_argument("-k", "--insecure", action="store_true", help="Ignore SSL cert errors")
     parser.add_argument("--show-ok", action="store_true", help="Show OK prefixes in output")
+    parser.add_argument("--snapshot", action="store_true", help="Record received routes per neighbor and report churn since the last snapshot")
+    parser.add_argument("--show-changes", action="store_true", help="With --snapshot, list every added, withdrawn and path-changed prefix")
     args = parser.parse_args()
 
     router = args.router
@@ -319,10 +327,32 @@ def main():
     print(f"\nAnalyzing {len(peers_to_check)} neighbor(s)...\n")
     for ip, asn in peers_to_check:
         routes = get_received_prefixes(router, api_key, ip, verify_ssl)
-        prefixes = parse_received_routes(routes)
+        prefixes = parse_received_routes(routes or "")
         print(f">>> Neighbor {ip} (AS{asn}) : [{len(prefixes)} prefixes]")
 
-        for prefix, path in prefixes:
+        snapshot_key = f"{router}_{ip}"
+        if args.snapshot and routes is None:
+            print(f"    Snapshot not recorded: fetching received routes from {router} failed")
+        elif args.snapshot and not prefixes and load_state(snapshot_key)[0]:
+            # an empty table after a non-empty one is far more likely a failed fetch than a full withdrawal
+            print(f"    Snapshot not recorded: no routes parsed, previous snapshot was not empty")
+        elif args.snapshot:
+            changes = record_snapshot(snapshot_key, dict(prefixes))
+            if changes is None:
+                print(f"    First snapshot recorded for {router} neighbor {ip}")
+            else:
+                print(f"    Churn: {summarize_changes(changes)}")
+                if args.show_changes:
+                    print_changes(changes, indent="    ")
+
+        # Paths are interned in the route table, so per-path checks run once per distinct path
+        # rather than once per route; every hop of every distinct path is classified up front
+        path_bogons = classify_paths(prefixes.paths)
+        path_leaks = [is_transit_leak(path) for path in prefixes.paths]
+
+        for i, (prefix, path) in enumerate(prefixes):
+            path_id = prefixes.path_ids[i]
+            bogon_hops = path_bogons[path_id]
             verdict_label = "ROUTE_OK"
 
             if prefix in ("0.0.0.0/0", "::/0"):
@@ -332,13 +362,17 @@ def main():
                     verdict_label = "BAD_ORIG_DEFAULT"
             elif is_bogon(prefix):
                 verdict_label = "BOGON_PREFIX"
-            elif "/" in prefix and int(prefix.split("/")[1]) > 24:
+            elif bogon_hops:
+                verdict_label = "BOGON_ASN"
+            elif prefixes.lens[i] > 24:
                 verdict_label = "PREFIX_TOOLONG"
-            elif is_transit_leak(path):
+            elif path_leaks[path_id]:
                 verdict_label = "TRANSIT_LEAK"
 
             if verdict_label != "ROUTE_OK" or args.show_ok:
                 print(f"    [{verdict_label.center(16)}]   {prefix:<23} {' '.join(str(asn) for asn in path)}")
+                if verdict_label == "BOGON_ASN":
+                    print(f"{'':<24}{', '.join(f'AS{hop} {hop_class}' for hop, hop_class in bogon_hops)}")
 
 if __name__ == "__main__":
     main()
@@ -5,6 +5,8 @@
 #!/usr/bin/env bash
 DEBUG="0"
 OUTPUT="1"
+COMPRESS="0"
+VERIFY=""
 MY_PDB_API_FILE=~/.pdb_api.txt
 
 if [ -z $1 ]; then
@@ -17,11 +19,16 @@ if [ -z $1 ]; then
  echo " "
  echo "PDB mode: specify second argument as target ASN, numeric only, example:"
  echo "16970"
+ echo " "
+ echo "Optional third argument -c compresses the list into the fewest ge/le entries"
+ echo "permitting exactly the same routes; -cv also proves equivalence (result on stderr)"
  echo " " 
  exit 1
 fi
 
 MODE="$1"
+[ "$3" == "-c" ] && COMPRESS="1"
+[ "$3" == "-cv" ] && COMPRESS="1" && VERIFY="1"
 
 if [ "$MODE" == "raw" ]; then
  REG=${2%::*}
@@ -81,6 +88,10 @@ if [ "$OUTPUT" == "1" ]; then
 	PREFIXES=$(~/bgpq4/bgpq4 -s -4 -R 24 -A -h whois.radb.net $AS_SET | grep -v "no ip prefix-list NN" | cut -d " " -f7)
  	RULENUM=10
  	echo "no ip prefix-list $PL4NAME"
+ 	if [ "$COMPRESS" == "1" ]; then
+ 		echo "$PREFIXES" | python3 ~/irr-toolbox/prefix_compress.py --format brocade --le4 24 --name "$PL4NAME" ${VERIFY:+--verify}
+ 		exit $?
+ 	fi
  	while read PREFIX; do
         echo "ip prefix-list $PL4NAME $RULENUM permit $PREFIX le 24"
         RULENUM=$((RULENUM+10))
@@ -4,11 +4,19 @@ import subprocess
 import re
 import json
 import time
+import atexit
 import argparse
 from time import sleep
 import urllib.request
 import csv
-from ipaddress import ip_network
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from route_snapshots import record_snapshot, summarize_changes, print_changes
+from route_table import RouteTable
+from transit_queue import (QUEUE_DB, open_queue, get_run, create_run, latest_unfinished_run, run_prefixes,
+                           release_dead_claims, release_worker, retry_failed, claim_prefix, complete_prefix,
+                           fail_prefix, run_progress, run_results, merge_queue, format_progress, worker_id, pid_alive)
 
 
 # === Colors ===
@@ -18,30 +26,78 @@ ANSI_UNDERLINE = "\033[4m"
 ANSI_RESET = "\033[0m"
 
 # === CLI Arguments ===
+def run_id_arg(value):
+    if not re.fullmatch(r"[A-Za-z0-9-]+", value):
+        raise argparse.ArgumentTypeError("run ID may only contain letters, digits and '-'")
+    return value
+
+def shard_arg(value):
+    m = re.fullmatch(r"(\d+)/(\d+)", value)
+    if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+        raise argparse.ArgumentTypeError("shard must be K/N with 1 <= K <= N")
+    return int(m.group(1)) - 1, int(m.group(2))
+
 parser = argparse.ArgumentParser(description="Check for unintended transit advertisement.")
-group = parser.add_mutually_exclusive_group(required=True)
+group = parser.add_mutually_exclusive_group()
 parser.add_argument("-a", "--target-asn", type=int, required=True, help="Your ASN (used to match transit routes)")
 group.add_argument("-s", "--as-set", help="IRR AS-SET to enumerate prefixes from")
 group.add_argument("-f", "--prefix-file", help="File containing prefixes to analyze")
 parser.add_argument("-m", "--missing", help="Comma-separated list of expected upstream ASNs.")
 parser.add_argument("-p", "--parallel", type=int, default=4, help="Number of parallel prefix queries (0 = sequential, 4 = default)")
 parser.add_argument("--no-cache", action="store_true", help="Force re-query even if recent data is cached")
+parser.add_argument("--expected-threshold", type=int, default=6, help="With -m, an expected upstream counts as seen on more than N routes (default 6)")
+parser.add_argument("--upstream-threshold", type=int, default=1, help="Report an observed upstream seen on more than N distinct paths (default 1)")
+parser.add_argument("--json", metavar="FILE", help="Also write the prefix x upstream matrix, with per-collector counts, as JSON")
+parser.add_argument("--csv", metavar="FILE", help="Also write the prefix x upstream matrix as CSV")
+parser.add_argument("--snapshot", action="store_true", help="Record observed paths and report changes since the last audit of this prefix set")
+parser.add_argument("--run-id", type=run_id_arg, help="Name of the audit run (default AS<target>-<datestamp>); naming an existing run joins it")
+parser.add_argument("--resume", action="store_true", help="Continue the latest unfinished run for this ASN (or --run-id), retrying failed prefixes")
+parser.add_argument("--queue", default=QUEUE_DB, help=f"Work queue database; put it on shared storage to spread a run across hosts (default {QUEUE_DB})")
+parser.add_argument("--worker", action="store_true", help="Only work through the run's queue, then exit without a report")
+parser.add_argument("--shard", type=shard_arg, metavar="K/N", help="When creating a run, only audit shard K of N here (for hosts without a shared queue); requires --run-id so every host's shard merges into one run")
+parser.add_argument("--merge", nargs="+", metavar="DB", help="Merge finished prefixes of this run from other hosts' queues before reporting")
 parser.add_argument("--debug", action="store_true", help="Enable debug output")
 args = parser.parse_args()
+if args.shard and not args.run_id:
+    parser.error("--shard requires --run-id: every host must use the same run ID for --merge to combine the shards")
 
 # === Configuration ===
 DATESTAMP = time.strftime("%Y%m%d-%H%M%S")
 ASN = str(args.target_asn)
 OUTPUT_DIR = os.path.expanduser("~/.workdir-irr-toolbox")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
-PREFIX_FILE = args.prefix_file or f"{OUTPUT_DIR}/prefixes.txt"
-OUTPUT_JSON = f"{OUTPUT_DIR}/bgp-tools.json"
 IGNORE_FILE = os.path.expanduser("~/.checkbgp_prefixignore")
 CACHE_TTL = 3600
 USER_AGENT_FILE = os.path.expanduser("~/.bgp-tools-useragent")
+WORKER = worker_id()
+
+# === Run Resolution ===
+queue = open_queue(args.queue)
+RUN_ID = args.run_id
+if args.resume and not RUN_ID:
+    RUN_ID = latest_unfinished_run(queue, args.target_asn)
+    if not RUN_ID:
+        print(f"ERROR: No unfinished run for AS{ASN} in {args.queue}")
+        exit(1)
+RUN_ID = RUN_ID or f"AS{ASN}-{DATESTAMP}"
+run = get_run(queue, RUN_ID)
+if run is None:
+    if args.resume:
+        print(f"ERROR: No run {RUN_ID} to resume in {args.queue}")
+        exit(1)
+    if not (args.as_set or args.prefix_file):
+        parser.error("one of the arguments -s/--as-set -f/--prefix-file is required to start a new run")
+elif run["target_asn"] != args.target_asn:
+    print(f"ERROR: Run {RUN_ID} audits AS{run['target_asn']}, not AS{ASN}")
+    exit(1)
+elif args.shard:
+    print(f"ERROR: --shard only applies when creating a run; {RUN_ID} already exists")
+    exit(1)
+PREFIX_FILE = args.prefix_file or f"{OUTPUT_DIR}/prefixes-{RUN_ID}.txt"
+OUTPUT_JSON = f"{OUTPUT_DIR}/bgp-tools-{RUN_ID}.json"
 
-def garbage_collect_tmux(debug=False):
-    """Kill stale tmux sessions created by this script only (prefixed with 'bgp_')"""
+def garbage_collect_tmux(run_id, debug=False):
+    """Kill this run's leftover tmux sessions: our own, and those of workers on this host that have exited"""
     try:
         result = subprocess.run(["tmux", "ls"], capture_output=True, text=True, check=False)
         if result.returncode != 0:
@@ -51,10 +107,11 @@ def garbage_collect_tmux(debug=False):
 
         sessions = result.stdout.strip().splitlines()
         for line in sessions:
-            match = re.match(r'^(bgp_[^\s:]+)', line)
+            match = re.match(rf'^(bgp_{re.escape(run_id)}_(\d+)_[^\s:]+)', line)
             if match:
-                session = match.group(1)
-                # Optional: Check age by pid file or timestamp if needed
+                session, owner = match.group(1), int(match.group(2))
+                if owner != os.getpid() and pid_alive(owner):
+                    continue  # a live worker of the same run
                 if debug:
                     print(f"+DEBUG: Killing stale tmux session: {session}")
                 subprocess.run(["tmux", "kill-session", "-t", session], check=False)
@@ -140,52 +197,66 @@ if args.missing:
     load_asn_names()  # populate ASN_MAP
 
 # === Prefix Acquisition ===
-if args.prefix_file:
-    if not os.path.exists(PREFIX_FILE):
-        print(f"ERROR: Prefix file not found: {PREFIX_FILE}")
-        exit(1)
-else:
-    debug(f"Enumerating prefixes from AS-SET: {args.as_set}")
-    result = subprocess.run(
-        ["./enumerate_as-set_prefixes", "-q", args.as_set],
-        stdout=open(PREFIX_FILE, "w"),
-        stderr=subprocess.PIPE,
-        text=True
-    )
-    if result.returncode != 0:
-        print(f"ERROR: Failed to enumerate prefixes from AS-SET: {args.as_set}")
-        print(result.stderr)
-        exit(1)
+if run is None:
+    if args.prefix_file:
+        if not os.path.exists(PREFIX_FILE):
+            print(f"ERROR: Prefix file not found: {PREFIX_FILE}")
+            exit(1)
+    else:
+        debug(f"Enumerating prefixes from AS-SET: {args.as_set}")
+        result = subprocess.run(
+            ["./enumerate_as-set_prefixes", "-q", args.as_set],
+            stdout=open(PREFIX_FILE, "w"),
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        if result.returncode != 0:
+            print(f"ERROR: Failed to enumerate prefixes from AS-SET: {args.as_set}")
+            print(result.stderr)
+            exit(1)
 
-with open(PREFIX_FILE, "r") as f:
-    all_prefixes = [line.strip() for line in f if line.strip()]
+    with open(PREFIX_FILE, "r") as f:
+        all_prefixes = [line.strip() for line in f if line.strip()]
 
-if not all_prefixes:
-    print("ERROR: Prefix list is empty.")
-    exit(1)
+    if not all_prefixes:
+        print("ERROR: Prefix list is empty.")
+        exit(1)
 
-# === Ignore File ===
-ignored_prefixes = set()
-if os.path.exists(IGNORE_FILE):
-    with open(IGNORE_FILE, "r") as f:
-        ignored_prefixes = set(line.strip() for line in f if line.strip())
-    debug(f"Found ignore file: {IGNORE_FILE}")
-    debug(f"Ignoring {len(ignored_prefixes)} prefix(es): {sorted(ignored_prefixes)}")
-else:
-    debug(f"No ignore file found at: {IGNORE_FILE}")
+    # === Ignore File ===
+    ignored_prefixes = set()
+    if os.path.exists(IGNORE_FILE):
+        with open(IGNORE_FILE, "r") as f:
+            ignored_prefixes = set(line.strip() for line in f if line.strip())
+        debug(f"Found ignore file: {IGNORE_FILE}")
+        debug(f"Ignoring {len(ignored_prefixes)} prefix(es): {sorted(ignored_prefixes)}")
+    else:
+        debug(f"No ignore file found at: {IGNORE_FILE}")
+
+    queried_prefixes = []
+    for prefix in all_prefixes:
+        if prefix in ignored_prefixes:
+            debug(f"Skipping {prefix} - listed in ignore file")
+        else:
+            queried_prefixes.append(prefix)
 
-queried_prefixes = []
-for prefix in all_prefixes:
-    if prefix in ignored_prefixes:
-        debug(f"Skipping {prefix} - listed in ignore file")
+    RUN_SOURCE = args.as_set or os.path.basename(PREFIX_FILE)
+    if create_run(queue, RUN_ID, args.target_asn, RUN_SOURCE, queried_prefixes, args.shard):
+        debug(f"Created run {RUN_ID} with {len(queried_prefixes)} prefix(es)")
     else:
-        queried_prefixes.append(prefix)
+        # another worker created the same run in the meantime
+        queried_prefixes = run_prefixes(queue, RUN_ID)
+else:
+    RUN_SOURCE = run["source"]
+    all_prefixes = queried_prefixes = run_prefixes(queue, RUN_ID)
+    ignored_prefixes = set()
+    debug(f"Joining run {RUN_ID} with {len(queried_prefixes)} prefix(es)")
 
 # === BGP Query Logic ===
 def query_prefix(prefix, force=False):
     sanitized = prefix.replace(".", "_").replace("/", "_")
-    session = f"bgp_{sanitized}"
-    output_file = f"{OUTPUT_DIR}/bgp-tools-{sanitized}.txt"
+    session = f"bgp_{RUN_ID}_{os.getpid()}_{sanitized}"
+    # the capture depends on the target ASN (match {ASN}); runs for other ASNs must not reuse it
+    output_file = f"{OUTPUT_DIR}/bgp-tools-AS{ASN}-{sanitized}.txt"
 
     if os.path.exists(output_file):
         age = time.time() - os.path.getmtime(output_file)
@@ -193,7 +264,7 @@ def query_prefix(prefix, force=False):
             debug(f"Forcing re-query of {prefix} - ignoring cache")
         elif not args.no_cache and age < CACHE_TTL:
             debug(f"Skipping {prefix} - cached file is fresh ({int(age)}s old)")
-            return
+            return output_file
         else:
             debug(f"Refreshing {prefix} - cached file is stale ({int(age)}s old)")
     else:
@@ -210,7 +281,10 @@ def query_prefix(prefix, force=False):
     subprocess.run(f'tmux send-keys -t {session} "{cmd}" C-m', shell=True, check=True)
     sleep(6)
 
-    subprocess.run(f"tmux capture-pane -t {session}:0 -pJS -99999 > {output_file}", shell=True, check=True)
+    # capture to a private file and rename, so a concurrent run never reads a half-written capture
+    partial_file = f"{output_file}.{RUN_ID}.{os.getpid()}.tmp"
+    subprocess.run(f"tmux capture-pane -t {session}:0 -pJS -99999 > {partial_file}", shell=True, check=True)
+    os.replace(partial_file, output_file)
     subprocess.run(f"tmux send-keys -t {session} C-d", shell=True, check=True)
 
     for _ in range(30):
@@ -225,94 +299,127 @@ def query_prefix(prefix, force=False):
         sleep(0.5)
     else:
         subprocess.run(f"tmux kill-session -t {session}", shell=True)
+    return output_file
 
-# === Perform Queries ===
-#for prefix in queried_prefixes:
-#    query_prefix(prefix)
-if args.parallel == 0:
-    if args.debug:
-        print(f"+DEBUG: Running prefix queries sequentially")
-    for prefix in queried_prefixes:
-        query_prefix(prefix)
-else:
-    if args.debug:
-        print(f"+DEBUG: Running prefix queries with {args.parallel} parallel threads")
-    from concurrent.futures import ThreadPoolExecutor, as_completed
+def audit_prefix(db, prefix, force=False):
+    """Query one prefix and checkpoint its capture in the run's queue"""
+    output_file = query_prefix(prefix, force)
+    with open(output_file, "r") as f:
+        complete_prefix(db, RUN_ID, prefix, f.read())
 
-    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
-        futures = {executor.submit(query_prefix, prefix): prefix for prefix in queried_prefixes}
-        for future in as_completed(futures):
-            prefix = futures[future]
+stopping = threading.Event()
+
+def run_worker():
+    """Claim and audit prefixes until nothing is left to claim (or we are interrupted)"""
+    db = open_queue(args.queue)
+    try:
+        while not stopping.is_set():
+            prefix = claim_prefix(db, RUN_ID, WORKER)
+            if prefix is None:
+                return
             try:
-                future.result()
+                audit_prefix(db, prefix)
             except Exception as e:
                 print(f"[!] Error querying {prefix}: {e}")
+                fail_prefix(db, RUN_ID, prefix, str(e))
+    finally:
+        db.close()
+
+def release_run():
+    """On exit, hand back unfinished claims and kill this process's tmux sessions"""
+    release_worker(queue, RUN_ID, WORKER)
+    garbage_collect_tmux(RUN_ID, args.debug)
+
+# === Merge Shards ===
+for merge_path in args.merge or []:
+    if not os.path.exists(merge_path):
+        print(f"ERROR: No queue at {merge_path}")
+        exit(1)
+    debug(f"Merged {merge_queue(queue, merge_path, RUN_ID)} finished prefix(es) from {merge_path}")
 
+# === Perform Queries ===
+released = release_dead_claims(queue, RUN_ID)
+if released:
+    debug(f"Released {released} prefix(es) claimed by exited workers on this host")
+if args.resume:
+    debug(f"Retrying {retry_failed(queue, RUN_ID)} failed prefix(es)")
+garbage_collect_tmux(RUN_ID, args.debug)
+atexit.register(release_run)
+print(f"Run {RUN_ID}: {format_progress(run_progress(queue, RUN_ID))}")
+
+while True:
+    if args.parallel == 0:
+        if args.debug:
+            print(f"+DEBUG: Running prefix queries sequentially")
+        try:
+            run_worker()
+        except KeyboardInterrupt:
+            stopping.set()
+    else:
+        if args.debug:
+            print(f"+DEBUG: Running prefix queries with {args.parallel} parallel threads")
+        with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+            futures = [executor.submit(run_worker) for _ in range(args.parallel)]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except KeyboardInterrupt:
+                # in-flight queries finish and are checkpointed before the pool shuts down
+                print("\nInterrupted, finishing in-flight queries...")
+                stopping.set()
+    if stopping.is_set():
+        print(f"Run {RUN_ID} interrupted: {format_progress(run_progress(queue, RUN_ID))}")
+        print(f"Continue it with: --run-id {RUN_ID} (or --resume)")
+        exit(130)
+
+    # Other workers may still hold claims; wait for them (expired leases are reclaimed by run_worker)
+    claimed = run_progress(queue, RUN_ID)["claimed"]
+    if args.worker or not claimed:
+        break
+    debug(f"Waiting for {claimed} prefix(es) claimed by other workers")
+    sleep(15)
+
+if args.worker:
+    print(f"Run {RUN_ID}: {format_progress(run_progress(queue, RUN_ID))}")
+    exit(0)
 
 debug("All queries complete. Beginning JSON conversion...")
 
 # === Parse Query Results ===
 line_pattern = re.compile(r'^\[\{AS(\d+)[^}]*\} [^\]]*\] \[([^\]]+)\] \{\[([^\]]*)\]\}')
-file_pattern = re.compile(r'bgp-tools-(.+)\.txt')
-
-def extract_prefix(filename):
-    basename = os.path.basename(filename)
-    m = file_pattern.match(basename)
-    if not m:
-        return None
-    parts = m.group(1).split("_")
-    if len(parts) != 5:
-        return None
-    return ".".join(parts[:4]) + "/" + parts[4]
-
-def parse_all_files():
-    combined = {}
-
-    expected_txt_files = {
-        f"{OUTPUT_DIR}/bgp-tools-{prefix.replace('.', '_').replace('/', '_')}.txt"
-        for prefix in queried_prefixes
-    }
-
-    for path in expected_txt_files:
-        prefix = extract_prefix(path)
-        if not prefix or not os.path.exists(path):
-            continue
 
-        try:
-            with open(path, "r") as f:
+def parse_run_results():
+    """Parse the checkpointed capture of every finished prefix of the run"""
+    combined = RouteTable()
+
+    for prefix, output in run_results(queue, RUN_ID):
+        buffer = ""
+        for line in output.splitlines():
+            buffer += line.strip() + " "
+            if buffer.strip().endswith("]}"):
+                match = line_pattern.match(buffer.strip())
+                if match:
+                    try:
+                        source_asn = int(match.group(1))
+                        as_path = [int(asn) for asn in match.group(2).split()]
+                        communities = match.group(3).split()
+                        combined.add(prefix, as_path, communities, source_asn)
+                    except Exception as inner_e:
+                        if args.debug:
+                            print(f"+DEBUG: Error parsing values for {prefix}: {inner_e}")
                 buffer = ""
-                for line in f:
-                    buffer += line.strip() + " "
-                    if buffer.strip().endswith("]}"):
-                        match = line_pattern.match(buffer.strip())
-                        if match:
-                            try:
-                                source_asn = int(match.group(1))
-                                as_path = [int(asn) for asn in match.group(2).split()]
-                                communities = match.group(3).split()
-                                combined.setdefault(prefix, []).append({
-                                    "source_asn": source_asn,
-                                    "as_path": as_path,
-                                    "communities": communities
-                                })
-                            except Exception as inner_e:
-                                if args.debug:
-                                    print(f"+DEBUG: Error parsing values in {path}: {inner_e}")
-                        buffer = ""
-        except Exception as outer_e:
-            if args.debug:
-                print(f"+DEBUG: Failed reading {path}: {outer_e}")
-            continue
 
     return combined
 
-combined_data = parse_all_files()
+combined_data = parse_run_results()
 with open(OUTPUT_JSON, "w") as f:
-    json.dump(combined_data, f, indent=2)
+    json.dump(combined_data.to_json_dict(), f, indent=2)
 
 # === Retry Missing Prefixes ===
-actual_prefixes = set(combined_data.keys())
-expected_prefixes = set(queried_prefixes)
+# prefixes of other shards are only reported once merged, never queried here
+unmerged_prefixes = set(run_prefixes(queue, RUN_ID, "remote"))
+actual_prefixes = combined_data.prefixes()
+expected_prefixes = set(queried_prefixes) - unmerged_prefixes
 missing_prefixes = sorted(expected_prefixes - actual_prefixes)
 
 if missing_prefixes:
@@ -320,11 +427,14 @@ if missing_prefixes:
     for p in missing_prefixes:
         debug(f"  - {p}")
     for p in missing_prefixes:
-        query_prefix(p, force=True)
-    debug("Retrying complete. Re-parsing all files...")
-    combined_data = parse_all_files()
+        try:
+            audit_prefix(queue, p, force=True)
+        except Exception as e:
+            print(f"[!] Error querying {p}: {e}")
+    debug("Retrying complete. Re-parsing all captures...")
+    combined_data = parse_run_results()
     with open(OUTPUT_JSON, "w") as f:
-        json.dump(combined_data, f, indent=2)
+        json.dump(combined_data.to_json_dict(), f, indent=2)
 
 # === Summary ===
 if args.debug:
@@ -332,9 +442,9 @@ if args.debug:
     print(f"+DEBUG: Total prefixes in input list    : {len(all_prefixes)}")
     print(f"+DEBUG: Ignored via prefix ignore file  : {len(ignored_prefixes)}")
     print(f"+DEBUG: Prefixes queried                : {len(queried_prefixes)}")
-    print(f"+DEBUG: Prefixes in final JSON output   : {len(combined_data)}")
+    print(f"+DEBUG: Prefixes in final JSON output   : {len(combined_data.prefixes())}")
 
-    still_missing = sorted(set(queried_prefixes) - set(combined_data.keys()))
+    still_missing = sorted(expected_prefixes - combined_data.prefixes())
     if still_missing:
         print(f"+DEBUG: Still missing {len(still_missing)} prefix(es) after retry:")
         for p in still_missing:
@@ -343,8 +453,131 @@ if args.debug:
         print("+DEBUG: All previously missing prefixes successfully recovered.")
     print(f"+DEBUG: JSON written to: {OUTPUT_JSON}")
 
+if unmerged_prefixes:
+    print(f"WARNING: {len(unmerged_prefixes)} prefix(es) of run {RUN_ID} belong to other shards and have not been merged (--merge)\n")
+
+# === Snapshot ===
+# A prefix that failed or sits in an unmerged shard would be recorded as withdrawn
+incomplete = {state: n for state, n in run_progress(queue, RUN_ID).items() if state != "done" and n}
+if args.snapshot and incomplete:
+    print(f"Snapshot not recorded: run {RUN_ID} is incomplete ({', '.join(f'{n} {state}' for state, n in incomplete.items())})\n")
+elif args.snapshot:
+    snapshot_key = f"transit_AS{ASN}_{RUN_SOURCE}"
+    observed_paths = {
+        prefix: sorted({combined_data.path(i) for i in rows})
+        for prefix, rows in combined_data.prefix_groups()
+    }
+    changes = record_snapshot(snapshot_key, observed_paths)
+    if changes is None:
+        print(f"First snapshot recorded for {snapshot_key}\n")
+    else:
+        print(f"Changes: {summarize_changes(changes)}")
+        if args.debug:
+            print_changes(changes)
+        print()
+
+# === Upstream Frequency Matrix ===
+NO_ROUTES = {"routes": 0, "collectors": {}}
+
+def build_upstream_matrix(table, target_asn, expected_upstreams=()):
+    """
+    One pass over every parsed route, building per prefix:
+      upstreams[prefix][asn] - routes where asn is the hop just before target_asn
+                               (after removing prepends): distinct paths, routes,
+                               and routes per collector (source ASN)
+      expected[prefix][asn]  - routes carrying an expected upstream anywhere in
+                               the path, in total and per collector (absent when none)
+    Path work (de-duplication, upstream, expected hops) is done once per
+    distinct interned path, not once per route.
+    """
+    expected_set = set(expected_upstreams)
+    path_info = {}      # path id -> (cleaned path id, upstream or None, expected hops)
+    cleaned_ids = {}
+    upstreams, expected = {}, {}
+
+    path_ids, sources, paths = table.path_ids, table.sources, table.paths
+    for prefix, rows in table.prefix_groups():
+        prefix_upstreams = upstreams[prefix] = {}
+        prefix_expected = expected[prefix] = {}
+        for i in rows:
+            pid = path_ids[i]
+            info = path_info.get(pid)
+            if info is None:
+                path = paths[pid]
+                upstream = cleaned_id = None
+                if target_asn in path and path[0] != target_asn:
+                    cleaned = tuple(dict.fromkeys(path))    # drop prepends, keep order
+                    cleaned_id = cleaned_ids.setdefault(cleaned, len(cleaned_ids))
+                    upstream = cleaned[cleaned.index(target_asn) - 1]
+                info = path_info[pid] = (cleaned_id, upstream, expected_set.intersection(path) if expected_set else ())
+            cleaned_id, upstream, expected_hops = info
+            source = sources[i]
+
+            if upstream is not None:
+                cell = prefix_upstreams.setdefault(upstream, {"paths": set(), "routes": 0, "collectors": {}})
+                cell["paths"].add(cleaned_id)
+                cell["routes"] += 1
+                cell["collectors"][source] = cell["collectors"].get(source, 0) + 1
+            for asn in expected_hops:
+                cell = prefix_expected.get(asn)
+                if cell is None:
+                    cell = prefix_expected[asn] = {"routes": 0, "collectors": {}}
+                cell["routes"] += 1
+                cell["collectors"][source] = cell["collectors"].get(source, 0) + 1
+
+    for prefix_upstreams in upstreams.values():
+        for cell in prefix_upstreams.values():
+            cell["paths"] = len(cell["paths"])
+    return upstreams, expected
+
+def write_matrix_json(path, upstreams, expected):
+    report = {
+        "target_asn": args.target_asn,
+        "generated": DATESTAMP,
+        "thresholds": {"expected_routes": args.expected_threshold, "upstream_paths": args.upstream_threshold},
+        "prefixes": {
+            prefix: {
+                "upstreams": {
+                    str(asn): dict(cell, name=ASN_MAP.get(asn, ""), significant=cell["paths"] > args.upstream_threshold)
+                    for asn, cell in sorted(upstreams[prefix].items())
+                },
+                "expected": {
+                    str(asn): dict(cell, name=ASN_MAP.get(asn, ""), seen=cell["routes"] > args.expected_threshold)
+                    for asn, cell in ((asn, expected[prefix].get(asn, NO_ROUTES)) for asn in EXPECTED_UPSTREAMS)
+                },
+            }
+            for prefix in upstreams
+        },
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+def write_matrix_csv(path, upstreams, expected):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["prefix", "kind", "asn", "name", "paths", "routes", "collectors", "verdict"])
+        for prefix in upstreams:
+            for asn in EXPECTED_UPSTREAMS:
+                cell = expected[prefix].get(asn, NO_ROUTES)
+                collectors = ";".join(f"{src}:{n}" for src, n in sorted(cell["collectors"].items()))
+                verdict = "OK" if cell["routes"] > args.expected_threshold else "FAIL"
+                writer.writerow([prefix, "expected", asn, ASN_MAP.get(asn, ""), "", cell["routes"], collectors, verdict])
+            for asn, cell in sorted(upstreams[prefix].items()):
+                collectors = ";".join(f"{src}:{n}" for src, n in sorted(cell["collectors"].items()))
+                verdict = "significant" if cell["paths"] > args.upstream_threshold else ""
+                writer.writerow([prefix, "upstream", asn, ASN_MAP.get(asn, ""), cell["paths"], cell["routes"], collectors, verdict])
+
+upstream_matrix, expected_matrix = build_upstream_matrix(combined_data, args.target_asn, EXPECTED_UPSTREAMS)
+
 load_asn_names()
 
+if args.json:
+    write_matrix_json(args.json, upstream_matrix, expected_matrix)
+    debug(f"Upstream matrix JSON written to: {args.json}")
+if args.csv:
+    write_matrix_csv(args.csv, upstream_matrix, expected_matrix)
+    debug(f"Upstream matrix CSV written to: {args.csv}")
+
 if EXPECTED_UPSTREAMS:
     header = f"{'Prefix':<20} {'Expected Upstream':<32} Status"
 else:
@@ -354,13 +587,12 @@ else:
 print(header)
 print("-" * len(header))
 
-for prefix, entries in sorted(combined_data.items(), key=lambda x: ip_network(x[0])):
+for prefix, prefix_upstreams in upstream_matrix.items():
     if EXPECTED_UPSTREAMS:
         for i, expected_asn in enumerate(EXPECTED_UPSTREAMS):
             name = ASN_MAP.get(expected_asn, "???")
             tag_text = f"{expected_asn} ({name})"
-            appearance_count = sum(1 for entry in entries if expected_asn in entry.get("as_path", []))
-            was_seen = appearance_count > 6
+            was_seen = expected_matrix[prefix].get(expected_asn, NO_ROUTES)["routes"] > args.expected_threshold
 
             # Colors
             color = ANSI_GREEN if was_seen else ANSI_RED
@@ -379,23 +611,8 @@ for prefix, entries in sorted(combined_data.items(), key=lambda x: ip_network(x[
         print()  # blank line between prefixes
         continue  # skip regular output
 
-    upstreams_by_path = {}  # key: tuple(as_path), value: upstream ASN (before target)
-    for entry in entries:
-        path = entry.get("as_path", [])
-        if args.target_asn not in path or path.index(args.target_asn) == 0:
-            continue
-        cleaned_path = []
-        [cleaned_path.append(asn) for asn in path if asn not in cleaned_path]  # dedup in-place
-        idx = cleaned_path.index(args.target_asn)
-        upstream = cleaned_path[idx - 1]
-        upstreams_by_path[tuple(cleaned_path)] = upstream
-
-    # Count frequency of each upstream ASN across unique as_paths
-    freq = {}
-    for upstream in upstreams_by_path.values():
-        freq[upstream] = freq.get(upstream, 0) + 1
-
-    significant_upstreams = sorted(asn for asn, count in freq.items() if count > 1)
+    # Upstreams seen on more than --upstream-threshold distinct (prepend-free) paths
+    significant_upstreams = sorted(asn for asn, cell in prefix_upstreams.items() if cell["paths"] > args.upstream_threshold)
     if not significant_upstreams:
         continue
 
@@ -406,4 +623,3 @@ for prefix, entries in sorted(combined_data.items(), key=lambda x: ip_network(x[
     for asn in significant_upstreams[1:]:
         print(f"{'':<20}{asn} ({ASN_MAP.get(asn, '')})")
     print()  # spacing between prefixes
-
@@ -5,6 +5,7 @@ import sys
 import subprocess
 import time
 import re
+import ipaddress
 
 VENV_DIR = os.path.expanduser("~/.venv-irr-toolbox")
 
@@ -32,18 +33,26 @@ ensure_venv_and_package()
 from irr_rpsl_client.client import RemoteClient
 import argparse
 
+from rir_delegations import load_index, lookup_many
+from iana_asn import classify_many
+from prefix_compress import format_range, with_le, compress_ranges, render, report_verification
+from rpsl_sets import set_class, expand_rpsl_set, FilterError, QueryError
+
 def parse_arguments():
     parser = argparse.ArgumentParser(
-        description="Enumerate prefixes from IRR aut-num or AS-SET objects (IPv4 only)"
+        description="Enumerate prefixes from IRR aut-num, AS-SET, route-set or filter-set objects"
     )
-    parser.add_argument("object", help="AS-SET or aut-num to enumerate")
+    parser.add_argument("object", help="AS-SET, aut-num, route-set (RS-) or filter-set (FLTR-) to enumerate")
     parser.add_argument("-s", "--source", help="IRR source server (default: rr.ntt.net)", default="rr.ntt.net")
-    parser.add_argument("-i", "--info", action="store_true", help="Verbose route object info")
+    parser.add_argument("-i", "--info", action="store_true", help="Verbose route object info (RIR, status and country from delegated stats)")
     parser.add_argument("-w", "--warning", action="store_true", help="Show warnings")
     parser.add_argument("-c", "--chain", action="store_true", help="Print parent->child ancestry")
-    parser.add_argument("--pl-vyos", action="store_true", help="Emit VyOS prefix-list output")
+    parser.add_argument("--pl-vyos", action="store_true", help="Emit VyOS prefix-list output, compressed into exactly equivalent ge/le rules")
+    parser.add_argument("--no-compress", action="store_true", help="With --pl-vyos, emit one rule per prefix instead")
+    parser.add_argument("--verify", action="store_true", help="With --pl-vyos, prove the compressed list permits exactly the raw list's routes")
     parser.add_argument("-q", "--quiet", action="store_true", help="Suppress output")
     parser.add_argument("--agg", action="store_true", help="Aggregate output prefixes")
+    parser.add_argument("-p", "--parallel", type=int, default=8, help="Concurrent IRR queries when expanding route-sets and filter-sets (default: 8)")
     parser.add_argument("--debug", action="store_true", help="Enable debug output")
     return parser.parse_args()
 
@@ -66,11 +75,50 @@ def enumerate_as_set(client, as_set, seen=None):
             asn_list.update(nested_asns)
     return asn_list
 
+def emit_pl_vyos(args, ranges):
+    """VyOS prefix-list rules for ranges, one list per address family"""
+    for version, pl in ((4, "prefix-list"), (6, "prefix-list6")):
+        family = [r for r in ranges if r[0].version == version]
+        if not family:
+            continue
+        name = f"PL{version}-IRR--{args.object.upper().replace(':', '-')}"
+        rules = family if args.no_compress else compress_ranges(family)
+        print(f"delete policy {pl} {name}")
+        print("\n".join(render(rules, "vyos", name)))
+        if args.verify and not report_verification(family, rules):
+            sys.exit(1)
+
 def main():
     args = parse_arguments()
     start_time = time.time()
     client = RemoteClient(args.source)
 
+    if set_class(args.object) in ("route-set", "filter-set"):
+        if args.debug:
+            print(f"[DEBUG] Detected {set_class(args.object)}: {args.object}")
+        try:
+            ranges, warnings = expand_rpsl_set(args.source, args.object, args.parallel, args.debug)
+        except (FilterError, QueryError) as e:
+            print(f"ERROR: {e}; refusing to emit a list that would not match the set", file=sys.stderr)
+            sys.exit(1)
+        if args.warning and not args.quiet:
+            for warning in warnings:
+                print(f"[WARNING] {warning}")
+        if args.pl_vyos:
+            emit_pl_vyos(args, ranges)
+        elif args.info and not args.quiet:
+            rir_info = lookup_many(load_index(debug=args.debug), {str(net) for net, _, _ in ranges})
+            for net, lo, hi in ranges:
+                rir, status, cc = rir_info.get(str(net)) or ("???", "", "")
+                print(f"{format_range(net, lo, hi):<26} {rir:<8} {status:<10} {cc}")
+        elif not args.quiet:
+            for net, lo, hi in ranges:
+                print(format_range(net, lo, hi))
+        if args.debug:
+            print(f"[DEBUG] {len(ranges)} prefix ranges")
+            print(f"Completed in {time.time() - start_time:.2f} seconds")
+        return
+
     if re.match(r"^AS\d+$", args.object, re.IGNORECASE):
         if args.debug:
             print(f"[DEBUG] Detected aut-num: {args.object}")
@@ -81,6 +129,10 @@ def main():
         asns = enumerate_as_set(client, args.object)
         if args.debug:
             print(f"[DEBUG] Found {len(asns)} unique ASNs from AS-SET")
+        if args.warning and not args.quiet:
+            for asn, (asn_class, _) in sorted(classify_many(int(a) for a in asns).items()):
+                if asn_class != "RIR":
+                    print(f"[WARNING] {args.object} member AS{asn} is a bogon ASN ({asn_class})")
         prefixes = set()
         for asn in asns:
             pfxs = extract_prefixes_from_autnum(client, asn)
@@ -88,7 +140,19 @@ def main():
             if args.debug:
                 print(f"[DEBUG] ASN AS{asn} yielded {len(pfxs)} prefixes")
 
-    if not args.quiet:
+    if args.pl_vyos:
+        # Route objects get the toolbox's usual le 24 / le 48 before compression; longer ones are
+        # dropped, as in the bash enumerator and every renderer
+        nets = [ipaddress.ip_network(p, strict=False) for p in prefixes]
+        nets = [net for net in nets if net.prefixlen <= (24 if net.version == 4 else 48)]
+        emit_pl_vyos(args, list(with_le(((net, net.prefixlen, net.prefixlen) for net in nets), 24, 48)))
+    elif args.info and not args.quiet:
+        # One batch attribution for the whole cone instead of whois per prefix
+        rir_info = lookup_many(load_index(debug=args.debug), prefixes)
+        for prefix in sorted(prefixes):
+            rir, status, cc = rir_info.get(prefix) or ("???", "", "")
+            print(f"{prefix:<20} {rir:<8} {status:<10} {cc}")
+    elif not args.quiet:
         for prefix in sorted(prefixes):
             print(prefix)
 
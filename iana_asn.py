@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+IANA AS number registry, compiled into a bisectable range table.
+
+Every ASN maps to one class:
+  RIR          assigned by IANA to an RIR (the RIR is reported alongside)
+  AS_TRANS     23456, only valid as a 4-byte ASN placeholder
+  DOCUMENTATION reserved for documentation and sample code (RFC5398)
+  PRIVATE      reserved for private use (RFC6996)
+  RESERVED     reserved by IANA (RFC7607, RFC7300, ...)
+  UNALLOCATED  not yet allocated to any RIR
+Anything other than RIR is a bogon ASN and has no business in an AS path
+or as-set.  Lookups are memoized, so each distinct ASN is classified once
+no matter how many paths or members it appears in.
+
+Usage: iana_asn.py [-b|--bogons-only] [asn ...]
+       (ASNs are read from stdin when none are given; AS prefix optional)
+
+Output is one line per ASN: ASN|CLASS|RIR
+"""
+
+import os
+import re
+import sys
+import argparse
+from bisect import bisect_right
+
+# === Configuration ===
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+IANA_ASN_SRC_FILE = os.path.join(SCRIPT_DIR, "data", "iana", "IANA-as-numbers.txt")
+
+# Registry rows: "   64512-65534 Reserved for Private Use    [RFC6996]"
+row_pattern = re.compile(r'^\s+(\d+)(?:-(\d+))?\s+(\S.*?)(?:\s{2,}|$)')
+
+RIR_NAMES = {
+    "AFRINIC": "AFRINIC",
+    "APNIC": "APNIC",
+    "ARIN": "ARIN",
+    "LACNIC": "LACNIC",
+    "RIPE NCC": "RIPE",
+}
+
+ASN_REGISTRY = None     # (starts, ends, records), loaded on first use
+ASN_CLASS_CACHE = {}    # asn -> (class, rir)
+
+
+def describe_to_class(description):
+    if description.startswith("Assigned by "):
+        rir = description[len("Assigned by "):].strip()
+        return ("RIR", RIR_NAMES.get(rir, rir))
+    if description == "AS_TRANS":
+        return ("AS_TRANS", "")
+    if description.startswith("Reserved for use in documentation"):
+        return ("DOCUMENTATION", "")
+    if description.startswith("Reserved for Private Use"):
+        return ("PRIVATE", "")
+    if description.startswith("Reserved"):
+        return ("RESERVED", "")
+    if description.startswith("Unallocated"):
+        return ("UNALLOCATED", "")
+    return None
+
+
+def load_asn_registry(path=IANA_ASN_SRC_FILE):
+    """Compile the IANA AS number registry text into sorted (starts, ends, records) lists"""
+    rows = []
+    with open(path, "r") as f:
+        for line in f:
+            match = row_pattern.match(line)
+            if not match:
+                continue
+            rec = describe_to_class(match.group(3))
+            if rec is None:
+                # e.g. the 32-bit table's "0-65535 See Sub-registry 16-bit AS numbers"
+                continue
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else start
+            rows.append((start, end, rec))
+
+    rows.sort(key=lambda r: r[0])
+    return ([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+
+
+def get_asn_registry():
+    global ASN_REGISTRY
+    if ASN_REGISTRY is None:
+        ASN_REGISTRY = load_asn_registry()
+    return ASN_REGISTRY
+
+
+def classify_asn(asn):
+    """Return (class, rir) for an ASN; ASNs outside the registry are UNALLOCATED"""
+    rec = ASN_CLASS_CACHE.get(asn)
+    if rec is None:
+        starts, ends, recs = get_asn_registry()
+        i = bisect_right(starts, asn) - 1
+        rec = recs[i] if i >= 0 and ends[i] >= asn else ("UNALLOCATED", "")
+        ASN_CLASS_CACHE[asn] = rec
+    return rec
+
+
+def classify_many(asns):
+    """Classify a batch of ASNs; returns {asn: (class, rir)} with each distinct ASN looked up once"""
+    return {asn: classify_asn(asn) for asn in set(asns)}
+
+
+def is_bogon_asn(asn):
+    return classify_asn(asn)[0] != "RIR"
+
+
+def path_bogons(path):
+    """Return [(asn, class)] for every hop in path that is not an RIR-assigned ASN"""
+    hops = [(asn, classify_asn(asn)[0]) for asn in path]
+    return [hop for hop in hops if hop[1] != "RIR"]
+
+
+def classify_paths(paths):
+    """
+    Batch form of path_bogons() for many paths: distinct ASNs across all paths
+    are classified first, then each path is reduced to its bogon hops.
+    """
+    classes = classify_many(asn for path in paths for asn in path)
+    bogons = {asn: rec[0] for asn, rec in classes.items() if rec[0] != "RIR"}
+    bogon_asns = bogons.keys()
+    return [
+        [] if bogon_asns.isdisjoint(path) else [(asn, bogons[asn]) for asn in path if asn in bogons]
+        for path in paths
+    ]
+
+
+def parse_asn(token):
+    token = token.strip().upper()
+    if token.startswith("AS"):
+        token = token[2:]
+    return int(token) if token.isdigit() else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify ASNs against the IANA AS number registry")
+    parser.add_argument("asns", nargs="*", help="ASNs to classify (default: read from stdin)")
+    parser.add_argument("-b", "--bogons-only", action="store_true", help="Only print ASNs that are not RIR-assigned")
+    args = parser.parse_args()
+
+    tokens = args.asns or sys.stdin.read().split()
+    for token in tokens:
+        asn = parse_asn(token)
+        if asn is None:
+            continue
+        asn_class, rir = classify_asn(asn)
+        if args.bogons_only and asn_class == "RIR":
+            continue
+        print(f"AS{asn}|{asn_class}|{rir}")
+
+
+if __name__ == "__main__":
+    main()
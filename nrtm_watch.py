@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+NRTMv3 watcher: keeps a local copy of an IRR source current and
+regenerates only the prefix lists an update actually touches.
+
+The object store (~/.workdir-irr-toolbox/nrtm/<SOURCE>.db, SQLite) holds
+the as-set, route-set, filter-set, route and route6 objects of one source
+plus dependency links: a set depends on its members, an aut-num on the
+route objects originated by it.  Every NRTM ADD/DEL replaces or removes
+one object and its links.  Walking the links backwards from the changed
+objects finds the registered roots that include them; only those roots
+are re-expanded (locally, from the store) and re-rendered.
+
+Usage: nrtm_watch.py load-dump <SOURCE> <dump[.gz]> --serial N
+       nrtm_watch.py add-root <SOURCE> <AS-SET|RS-|FLTR-|ASn> [--format F] [--name NAME] [--le4 N] [--le6 N] [--no-compress]
+       nrtm_watch.py watch <SOURCE> --host HOST [--port 43] [--interval 60] [--once]
+       nrtm_watch.py regen <SOURCE> [root ...]
+       nrtm_watch.py serve <SOURCE> <journal> [--port 4343]
+             (stand-in NRTMv3 server replaying a journal of ADD/DEL blocks, for testing)
+
+Lists are written to ~/.workdir-irr-toolbox/nrtm/lists/<SOURCE>/<root>.txt.
+Only NRTMv3 over whois is spoken; NRTMv4 (signed JSON over HTTPS) is not.
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import ipaddress
+import socketserver
+
+from rpsl_sets import member_key, parse_set_object, expand_set, rpsl_attributes, FilterError
+from prefix_compress import with_le, compress_ranges, render
+
+# === Configuration ===
+OUTPUT_DIR = os.path.expanduser("~/.workdir-irr-toolbox")
+NRTM_DIR = os.path.join(OUTPUT_DIR, "nrtm")
+SET_CLASSES = ("as-set", "route-set", "filter-set")
+ROUTE_CLASSES = ("route", "route6")
+
+op_pattern = re.compile(r"^(ADD|DEL)(?:\s+(\d+))?\s*$")
+range_error_pattern = re.compile(r"Not within (\d+)-(\d+)")
+
+
+def debug_print(debug, message):
+    if debug:
+        print(f"+DEBUG: {message}")
+
+
+# === Object store ===
+
+def open_store(source):
+    os.makedirs(NRTM_DIR, exist_ok=True)
+    db = sqlite3.connect(os.path.join(NRTM_DIR, f"{source.upper()}.db"))
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS objects (class TEXT, key TEXT, text TEXT, PRIMARY KEY (class, key));
+        CREATE TABLE IF NOT EXISTS deps (node_class TEXT, node_key TEXT, dep_class TEXT, dep_key TEXT);
+        CREATE INDEX IF NOT EXISTS deps_node ON deps (node_class, node_key);
+        CREATE INDEX IF NOT EXISTS deps_dep ON deps (dep_class, dep_key);
+        CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS roots (name TEXT PRIMARY KEY, options TEXT);
+    """)
+    return db
+
+
+def get_serial(db):
+    row = db.execute("SELECT value FROM meta WHERE name = 'serial'").fetchone()
+    return int(row[0]) if row else None
+
+
+def set_serial(db, serial):
+    db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('serial', ?)", (str(serial),))
+
+
+def parse_object(text):
+    """RPSL text -> (class, key, [(node, dep)]) for stored classes, None for anything else"""
+    attrs = rpsl_attributes(text)
+    if not attrs:
+        return None
+    cls, name = attrs[0]
+    if cls in SET_CLASSES:
+        key = name.upper()
+        _value, refs = parse_set_object(cls, text)
+        return cls, key, [((cls, key), ref) for ref in refs]
+    if cls in ROUTE_CLASSES:
+        origin = next((value.upper() for attr, value in attrs if attr == "origin"), None)
+        if not origin:
+            return None
+        try:
+            key = f"{ipaddress.ip_network(name, strict=False)}{origin}"
+        except ValueError:
+            # skipped, not fatal: the serial must still advance past a broken object
+            print(f"WARNING: Skipping {cls} object with invalid prefix {name}", file=sys.stderr)
+            return None
+        return cls, key, [(("aut-num", origin), (cls, key))]
+    return None
+
+
+def route_prefix(key):
+    """route key '192.0.2.0/24AS65000' -> '192.0.2.0/24'"""
+    return key.rpartition("AS")[0]
+
+
+def dependents(db, key, seen):
+    """Every node that depends on key, directly or through other nodes; skips nodes already in seen"""
+    found = []
+    queue = [key]
+    while queue:
+        node = queue.pop()
+        for parent in db.execute("SELECT node_class, node_key FROM deps WHERE dep_class = ? AND dep_key = ?", node):
+            if parent not in seen:
+                seen.add(parent)
+                found.append(parent)
+                queue.append(parent)
+    return found
+
+
+def apply_update(db, op, text, seen=None):
+    """
+    Apply one ADD or DEL to the store.  Returns the changed object's key and
+    the nodes depending on it, both before the update (what a DEL or a
+    replaced ADD takes away) and after it (what an ADD brings in).
+    """
+    parsed = parse_object(text)
+    if parsed is None:
+        return None, []
+    cls, key, links = parsed
+    seen = set() if seen is None else seen
+    affected = dependents(db, (cls, key), seen)
+
+    if cls in ROUTE_CLASSES:
+        db.execute("DELETE FROM deps WHERE dep_class = ? AND dep_key = ?", (cls, key))
+    else:
+        db.execute("DELETE FROM deps WHERE node_class = ? AND node_key = ?", (cls, key))
+    db.execute("DELETE FROM objects WHERE class = ? AND key = ?", (cls, key))
+
+    if op == "ADD":
+        db.execute("INSERT INTO objects (class, key, text) VALUES (?, ?, ?)", (cls, key, text))
+        db.executemany("INSERT INTO deps (node_class, node_key, dep_class, dep_key) VALUES (?, ?, ?, ?)",
+                       [node + dep for node, dep in links])
+        affected += dependents(db, (cls, key), seen)
+    return (cls, key), affected
+
+
+def affected_roots(db, changed):
+    """Registered roots among the changed keys and their dependents"""
+    roots = {}
+    for (name,) in db.execute("SELECT name FROM roots"):
+        roots[member_key(name)] = name
+    return sorted({roots[key] for key in changed if key in roots})
+
+
+def rpsl_blocks(f):
+    """Yield the objects of an RPSL dump as text, comments skipped"""
+    block = []
+    for line in f:
+        if line.startswith(("%", "#")):
+            continue
+        if line.strip():
+            block.append(line.rstrip("\n"))
+        elif block:
+            yield "\n".join(block)
+            block = []
+    if block:
+        yield "\n".join(block)
+
+
+def load_dump(db, path, serial, debug=False):
+    """Replace the store's objects with an RPSL dump taken at serial"""
+    opener = gzip.open if path.endswith(".gz") else open
+    db.execute("DELETE FROM objects")
+    db.execute("DELETE FROM deps")
+    count = 0
+    with opener(path, "rt", errors="replace") as f:
+        for text in rpsl_blocks(f):
+            # cheap class check first: most of a dump is classes we do not store
+            if text.split(":", 1)[0].lower() not in SET_CLASSES + ROUTE_CLASSES:
+                continue
+            parsed = parse_object(text)
+            if parsed is None:
+                continue
+            cls, key, links = parsed
+            db.execute("INSERT OR REPLACE INTO objects (class, key, text) VALUES (?, ?, ?)", (cls, key, text))
+            db.executemany("INSERT INTO deps (node_class, node_key, dep_class, dep_key) VALUES (?, ?, ?, ?)",
+                           [node + dep for node, dep in links])
+            count += 1
+    set_serial(db, serial)
+    db.commit()
+    debug_print(debug, f"Loaded {count} objects from {path}, serial {serial}")
+    return count
+
+
+# === Expansion and rendering ===
+
+def store_graph(db, root):
+    """The {key: value} graph under root for rpsl_sets.expand_set(), read from the store"""
+    objects = {}
+    queue = [root]
+    while queue:
+        key = queue.pop()
+        if key in objects:
+            continue
+        cls, name = key
+        if cls == "aut-num":
+            rows = db.execute("SELECT dep_key FROM deps WHERE node_class = 'aut-num' AND node_key = ?", (name,))
+            objects[key] = [route_prefix(dep_key) for (dep_key,) in rows]
+            continue
+        row = db.execute("SELECT text FROM objects WHERE class = ? AND key = ?", key).fetchone()
+        if row is None:
+            objects[key] = None
+            continue
+        objects[key], refs = parse_set_object(cls, row[0])
+        queue.extend(refs)
+    return objects
+
+
+def list_path(source, name):
+    return os.path.join(NRTM_DIR, "lists", source.upper(), re.sub(r"[^A-Za-z0-9._-]", "-", name) + ".txt")
+
+
+def regenerate(db, source, name, debug=False):
+    """Re-expand one root from the store and rewrite its list; returns True when the list changed"""
+    row = db.execute("SELECT options FROM roots WHERE name = ?", (name,)).fetchone()
+    options = json.loads(row[0]) if row else {}
+    key = member_key(name)
+    warnings = []
+    try:
+        items = expand_set(store_graph(db, key), key, warnings)
+    except FilterError as e:
+        print(f"ERROR: {name}: {e}; keeping the previous list", file=sys.stderr)
+        return False
+    ranges = list(with_le(sorted(items, key=lambda i: (i[0].version, i[0], i[1], i[2])),
+                          options.get("le4"), options.get("le6")))
+    if not options.get("no_compress"):
+        ranges = compress_ranges(ranges)
+    list_name = options.get("name") or f"PL-{source.upper()}--{name.replace(':', '-')}"
+    content = "\n".join(render(ranges, options.get("format", "plain"), list_name)) + "\n"
+    for warning in warnings:
+        debug_print(debug, f"{name}: {warning}")
+
+    path = list_path(source, name)
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        f.write(content)
+    os.replace(path + ".tmp", path)
+    print(f"Regenerated {name}: {len(ranges)} entries -> {path}")
+    return True
+
+
+# === NRTMv3 ===
+
+def parse_nrtm_stream(text):
+    """NRTMv3 response body -> [(op, serial, object text)]"""
+    updates = []
+    op = serial = None
+    block = []
+
+    def flush():
+        if op and block:
+            updates.append((op, serial, "\n".join(block)))
+
+    for line in text.splitlines():
+        if line.startswith("%"):
+            continue
+        match = op_pattern.match(line)
+        if match:
+            flush()
+            op, serial, block = match.group(1), int(match.group(2)) if match.group(2) else None, []
+        elif line.strip():
+            block.append(line)
+        elif block:
+            # a blank line ends the object; the next one needs its own ADD/DEL
+            flush()
+            op, block = None, []
+    flush()
+    return updates
+
+
+def nrtm_fetch(host, port, source, first, timeout=60):
+    """Request serials first..LAST; returns the response text, "" when already current"""
+    data = b""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(f"-g {source.upper()}:3:{first}-LAST\n".encode())
+        while b"%END" not in data and b"%ERROR" not in data:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    text = data.decode(errors="replace")
+
+    error = next((line for line in text.splitlines() if line.startswith("%ERROR")), None)
+    if error:
+        match = range_error_pattern.search(error)
+        if match and first > int(match.group(2)):
+            return ""
+        raise RuntimeError(f"{host}:{port} refused serial {first}: {error} (reload the store with load-dump)")
+    return text
+
+
+def watch(db, source, host, port, interval, once=False, debug=False):
+    while True:
+        serial = get_serial(db)
+        if serial is None:
+            sys.exit(f"ERROR: No serial for {source}; seed the store with load-dump first")
+
+        updates = parse_nrtm_stream(nrtm_fetch(host, port, source, serial + 1))
+        if updates:
+            seen = set()
+            changed = set()
+            for op, update_serial, text in updates:
+                key, affected = apply_update(db, op, text, seen)
+                if key:
+                    changed.add(key)
+                    changed.update(affected)
+                serial = update_serial or serial
+            set_serial(db, serial)
+            db.commit()
+
+            roots = affected_roots(db, changed)
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {source} serial {serial}: "
+                  f"{len(updates)} updates, {len(roots)} affected root(s)")
+            for name in roots:
+                regenerate(db, source, name, debug)
+        else:
+            debug_print(debug, f"{source} current at serial {serial}")
+
+        if once:
+            return
+        time.sleep(interval)
+
+
+def read_journal(path):
+    with open(path) as f:
+        return parse_nrtm_stream(f.read())
+
+
+def serve(source, journal, port):
+    """Answer '-g SOURCE:3:FIRST-LAST' from a journal file, re-read on every query"""
+    source = source.upper()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            query = self.rfile.readline().decode(errors="replace").strip()
+            match = re.match(r"^-g\s+(\S+):3:(\d+)-(\d+|LAST)$", query)
+            if not match or match.group(1).upper() != source:
+                self.wfile.write(b"%ERROR:403: unknown source or query\n")
+                return
+            updates = read_journal(journal)
+            serials = [serial for _, serial, _ in updates] or [0]
+            first = int(match.group(2))
+            last = serials[-1] if match.group(3) == "LAST" else int(match.group(3))
+            if not serials[0] <= first <= serials[-1]:
+                self.wfile.write(f"%ERROR:401: invalid range: Not within {serials[0]}-{serials[-1]}\n".encode())
+                return
+            out = [f"%START Version: 3 {source} {first}-{last}", ""]
+            for op, serial, text in updates:
+                if first <= serial <= last:
+                    out += [f"{op} {serial}", "", text, ""]
+            out.append(f"%END {source}")
+            self.wfile.write(("\n".join(out) + "\n").encode())
+
+    class Server(socketserver.ThreadingTCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    print(f"Serving {source} journal {journal} as NRTMv3 on port {port}")
+    with Server(("", port), Handler) as server:
+        server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep prefix lists current from an IRR NRTMv3 stream")
+    parser.add_argument("--debug", action="store_true", help="Enable debug output")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("load-dump", help="Seed the object store from an RPSL dump")
+    p.add_argument("source")
+    p.add_argument("dump")
+    p.add_argument("--serial", type=int, required=True, help="Serial the dump was taken at (e.g. from SOURCE.CURRENTSERIAL)")
+
+    p = sub.add_parser("add-root", help="Register a set or aut-num whose prefix list is kept current")
+    p.add_argument("source")
+    p.add_argument("root")
+    p.add_argument("--format", choices=["plain", "vyos", "junos", "brocade"], default="plain")
+    p.add_argument("--name", help="Prefix-list name (default: PL-<SOURCE>--<root>)")
+    p.add_argument("--le4", type=int, help="Bare IPv4 prefixes shorter than N also permit more specifics up to N")
+    p.add_argument("--le6", type=int, help="Bare IPv6 prefixes shorter than N also permit more specifics up to N")
+    p.add_argument("--no-compress", action="store_true", help="One entry per prefix instead of compressed ge/le entries")
+
+    p = sub.add_parser("watch", help="Apply NRTM updates and regenerate affected lists")
+    p.add_argument("source")
+    p.add_argument("--host", required=True)
+    p.add_argument("--port", type=int, default=43)
+    p.add_argument("--interval", type=int, default=60, help="Seconds between polls (default 60)")
+    p.add_argument("--once", action="store_true", help="Poll once and exit")
+
+    p = sub.add_parser("regen", help="Regenerate lists from the store (default: every root)")
+    p.add_argument("source")
+    p.add_argument("roots", nargs="*")
+
+    p = sub.add_parser("serve", help="Stand-in NRTMv3 server replaying a journal file")
+    p.add_argument("source")
+    p.add_argument("journal")
+    p.add_argument("--port", type=int, default=4343)
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.source, args.journal, args.port)
+        return
+
+    db = open_store(args.source)
+    if args.command == "load-dump":
+        count = load_dump(db, args.dump, args.serial, args.debug)
+        print(f"Loaded {count} objects into the {args.source.upper()} store at serial {args.serial}")
+    elif args.command == "add-root":
+        if member_key(args.root) is None:
+            sys.exit(f"ERROR: {args.root} is not an as-set, route-set, filter-set or aut-num")
+        options = {"format": args.format, "name": args.name, "le4": args.le4, "le6": args.le6,
+                   "no_compress": args.no_compress}
+        db.execute("INSERT OR REPLACE INTO roots (name, options) VALUES (?, ?)", (args.root.upper(), json.dumps(options)))
+        db.commit()
+        regenerate(db, args.source, args.root.upper(), args.debug)
+    elif args.command == "watch":
+        watch(db, args.source, args.host, args.port, args.interval, args.once, args.debug)
+    elif args.command == "regen":
+        names = [r.upper() for r in args.roots] or [name for (name,) in db.execute("SELECT name FROM roots")]
+        for name in names:
+            if not regenerate(db, args.source, name, args.debug):
+                print(f"{name}: unchanged")
+
+
+if __name__ == "__main__":
+    main()
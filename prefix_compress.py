@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Exact ge/le prefix-list compression.
+
+A prefix list permits a set of routes: "P ge X le Y" matches every prefix
+inside P whose length is between X and Y.  Taken one prefix length at a
+time that set is a plain set of address blocks, and its smallest exact
+cover is its CIDR aggregate: sibling blocks collapse into their parent in
+the binary trie until no two siblings are left.  Each block of those
+per-length aggregates becomes one "P ge X le Y" entry, stretched over
+every neighbouring length it is also valid for.  Thousands of /24s inside
+a few covering blocks come out as a handful of "P ge 24 le 24" entries
+that still match exactly the same routes; nothing is widened, unlike
+aggregate6-style aggregation.
+
+--verify rebuilds the per-length aggregates of the raw list and of the
+compressed list and requires them to be identical, which proves both
+lists permit the same routes.
+
+Input: one entry per line, as a bare prefix, in RPSL range notation
+(P^+, P^-, P^n, P^n-m) or as "P [ge X] [le Y]".
+
+Usage: prefix_compress.py [-f FILE] [--le4 N] [--le6 N] [--verify]
+                          [--format plain|vyos|junos|brocade] [--name NAME]
+       (--le4/--le6 give bare prefixes shorter than N an "le N", like the
+       renderer scripts do; verification results go to stderr)
+"""
+
+import sys
+import argparse
+import ipaddress
+from bisect import bisect_right
+
+RULE_START = 10
+RULE_STEP = 10
+
+
+# === Parsing and formatting ===
+
+def parse_entry(line):
+    """'10.0.0.0/8^16-24' or '10.0.0.0/8 ge 16 le 24' -> (network, lo, hi)"""
+    fields = line.split()
+    base, _, op = fields[0].partition("^")
+    net = ipaddress.ip_network(base, strict=False)
+    length, max_length = net.prefixlen, net.max_prefixlen
+    lo = hi = length
+
+    if op == "+":
+        hi = max_length
+    elif op == "-":
+        lo, hi = length + 1, max_length
+    elif op:
+        lo, _, hi = op.partition("-")
+        lo, hi = int(lo), int(hi or lo)
+
+    options = dict(zip(fields[1::2], fields[2::2]))
+    if "ge" in options:
+        lo = int(options["ge"])
+        hi = max_length
+    if "le" in options:
+        hi = int(options["le"])
+
+    if not length <= lo <= hi <= max_length:
+        raise ValueError(f"invalid prefix range: {line}")
+    return net, lo, hi
+
+
+def with_le(ranges, le4=None, le6=None):
+    """Give bare prefixes shorter than the family's limit an 'le' up to it"""
+    for net, lo, hi in ranges:
+        limit = le4 if net.version == 4 else le6
+        if limit and lo == hi == net.prefixlen < limit:
+            hi = limit
+        yield net, lo, hi
+
+
+def format_range(net, lo, hi):
+    """RPSL notation for a prefix range: bare prefix, ^+, ^-, ^n or ^n-m"""
+    length, max_length = net.prefixlen, net.max_prefixlen
+    if (lo, hi) == (length, length):
+        return str(net)
+    if (lo, hi) == (length, max_length):
+        return f"{net}^+"
+    if (lo, hi) == (length + 1, max_length):
+        return f"{net}^-"
+    if lo == hi:
+        return f"{net}^{lo}"
+    return f"{net}^{lo}-{hi}"
+
+
+def format_ge_le(net, lo, hi):
+    """Cisco/FRR-style 'ge X le Y' suffix; ge must be longer than the prefix itself"""
+    if (lo, hi) == (net.prefixlen, net.prefixlen):
+        return ""
+    if lo == net.prefixlen:
+        return f" le {hi}"
+    return f" ge {lo} le {hi}"
+
+
+def format_junos(net, lo, hi):
+    length, max_length = net.prefixlen, net.max_prefixlen
+    if (lo, hi) == (length, length):
+        return f"{net} exact;"
+    if (lo, hi) == (length, max_length):
+        return f"{net} orlonger;"
+    if (lo, hi) == (length + 1, max_length):
+        return f"{net} longer;"
+    if lo == length:
+        return f"{net} upto /{hi};"
+    return f"{net} prefix-length-range /{lo}-/{hi};"
+
+
+def render(ranges, fmt="plain", name="PL-CHANGE-MY-NAME"):
+    """Lines of config for ranges; vyos and brocade number rules from 10 in steps of 10 per family"""
+    lines = []
+    if fmt == "junos":
+        lines.append(f"route-filter-list {name} {{")
+        lines.extend(f"    {format_junos(*r)}" for r in ranges)
+        lines.append("}")
+        return lines
+
+    rules = {4: RULE_START, 6: RULE_START}
+    for net, lo, hi in ranges:
+        rule = rules[net.version]
+        rules[net.version] += RULE_STEP
+        if fmt == "vyos":
+            pl = "prefix-list" if net.version == 4 else "prefix-list6"
+            lines.append(f"set policy {pl} {name} rule {rule} action permit")
+            if lo > net.prefixlen:
+                lines.append(f"set policy {pl} {name} rule {rule} ge {lo}")
+            if hi > net.prefixlen:
+                lines.append(f"set policy {pl} {name} rule {rule} le {hi}")
+            lines.append(f"set policy {pl} {name} rule {rule} prefix {net}")
+        elif fmt == "brocade":
+            family = "ip" if net.version == 4 else "ipv6"
+            lines.append(f"{family} prefix-list {name} {rule} permit {net}{format_ge_le(net, lo, hi)}")
+        else:
+            lines.append(format_range(net, lo, hi))
+    return lines
+
+
+# === Per-length aggregates ===
+#
+# Blocks are (int network, length) pairs.  level_sets() maps every prefix
+# length L to the CIDR aggregate of the length-L routes a list permits:
+# sorted, disjoint, maximal blocks.
+
+def aggregate(blocks, bits):
+    """Collapse aligned blocks into the minimal set of maximal disjoint blocks"""
+    stack = []
+    for net, length in sorted(set(blocks)):
+        if stack:
+            top_net, top_len = stack[-1]
+            if net >> (bits - top_len) == top_net >> (bits - top_len):
+                continue    # inside the previous block
+        stack.append((net, length))
+        # merge siblings bottom-up, like collapsing a binary trie
+        while len(stack) >= 2:
+            (a_net, a_len), (b_net, b_len) = stack[-2], stack[-1]
+            if a_len != b_len or a_len == 0:
+                break
+            size = 1 << (bits - a_len)
+            if a_net & size or b_net != a_net + size:
+                break
+            stack[-2:] = [(a_net, a_len - 1)]
+    return stack
+
+
+def level_sets(ranges, bits):
+    """{length: aggregate} for (int network, length, lo, hi) ranges of one address family"""
+    levels = {}
+    for net, length, lo, hi in ranges:
+        for level in range(lo, hi + 1):
+            levels.setdefault(level, []).append((net, length))
+    return {level: aggregate(blocks, bits) for level, blocks in levels.items()}
+
+
+def covers(aggregate_blocks, starts, net, length, bits):
+    """True when the block (net, length) lies inside one block of an aggregate"""
+    i = bisect_right(starts, net) - 1
+    if i < 0:
+        return False
+    a_net, a_len = aggregate_blocks[i]
+    return length >= a_len and net >> (bits - a_len) == a_net >> (bits - a_len)
+
+
+def split_families(ranges):
+    families = {}
+    for net, lo, hi in ranges:
+        families.setdefault(net.version, (net.max_prefixlen, []))[1].append(
+            (int(net.network_address), net.prefixlen, lo, hi))
+    return families
+
+
+def compress_family(ranges, bits):
+    levels = level_sets(ranges, bits)
+    starts = {level: [net for net, _ in blocks] for level, blocks in levels.items()}
+
+    def permitted(net, length, level):
+        return level >= length and level in levels and covers(levels[level], starts[level], net, length, bits)
+
+    needed = {}     # block -> lengths at which it is a maximal aggregate block
+    for level, blocks in levels.items():
+        for block in blocks:
+            needed.setdefault(block, []).append(level)
+
+    entries = []
+    for (net, length), need in needed.items():
+        need.sort()
+        lo = hi = need[0]
+        for level in need[1:]:
+            # stretch the entry over lengths where the block is already permitted
+            # (inside a bigger block) rather than start a second entry for it
+            if all(permitted(net, length, gap) for gap in range(hi + 1, level)):
+                hi = level
+            else:
+                entries.append([net, length, lo, hi])
+                lo = hi = level
+        entries.append([net, length, lo, hi])
+
+    # Stretch every entry as far as it stays exact; the wider entries can then
+    # make others redundant, e.g. two /14^17-21 and ^21-22 siblings cover the /13^21
+    for entry in entries:
+        net, length, lo, hi = entry
+        while permitted(net, length, lo - 1):
+            lo -= 1
+        while permitted(net, length, hi + 1):
+            hi += 1
+        entry[2:] = [lo, hi]
+    return drop_redundant([tuple(e) for e in entries], bits)
+
+
+def drop_redundant(entries, bits):
+    """Remove entries whose routes the remaining entries already permit, narrowest first"""
+    by_level = {}   # level -> {block: number of live entries contributing it}
+    for net, length, lo, hi in entries:
+        for level in range(lo, hi + 1):
+            blocks = by_level.setdefault(level, {})
+            blocks[(net, length)] = blocks.get((net, length), 0) + 1
+    starts = {level: sorted(blocks) for level, blocks in by_level.items()}
+
+    def covered_by_others(net, length, level):
+        blocks = by_level[level]
+        if blocks[(net, length)] > 1:
+            return True
+        for shorter in range(length - 1, -1, -1):
+            mask = ((1 << bits) - 1) ^ ((1 << (bits - shorter)) - 1)
+            if blocks.get((net & mask, shorter)):
+                return True
+        ordered = starts[level]
+        end = net + (1 << (bits - length))
+        inner = [block for block in ordered[bisect_right(ordered, (net, length)):bisect_right(ordered, (end, -1))]
+                 if blocks[block]]
+        return aggregate(inner, bits) == [(net, length)]
+
+    kept = []
+    for entry in sorted(entries, key=lambda e: (e[3] - e[2], e[1])):
+        net, length, lo, hi = entry
+        if all(covered_by_others(net, length, level) for level in range(lo, hi + 1)):
+            for level in range(lo, hi + 1):
+                by_level[level][(net, length)] -= 1
+        else:
+            kept.append(entry)
+    return kept
+
+
+def compress_ranges(ranges):
+    """
+    Compress (network, lo, hi) ranges into an equivalent, smaller list of
+    (network, lo, hi) entries, sorted by family, address and length.
+    """
+    result = []
+    for version, (bits, family) in sorted(split_families(ranges).items()):
+        cls = ipaddress.IPv4Network if version == 4 else ipaddress.IPv6Network
+        entries = compress_family(family, bits)
+        if len(entries) > len(set(family)):
+            entries = set(family)   # never hand back a longer list than we were given
+        for net, length, lo, hi in sorted(entries):
+            result.append((cls((net, length)), lo, hi))
+    return result
+
+
+def verify_ranges(raw, compressed):
+    """[(version, length)] at which the two lists permit different routes; empty means equivalent"""
+    raw_families, comp_families = split_families(raw), split_families(compressed)
+    mismatches = []
+    for version in sorted(set(raw_families) | set(comp_families)):
+        bits = 32 if version == 4 else 128
+        raw_levels = level_sets(raw_families.get(version, (bits, []))[1], bits)
+        comp_levels = level_sets(comp_families.get(version, (bits, []))[1], bits)
+        for level in sorted(set(raw_levels) | set(comp_levels)):
+            if raw_levels.get(level) != comp_levels.get(level):
+                mismatches.append((version, level))
+    return mismatches
+
+
+def report_verification(raw, compressed):
+    """Print the verify_ranges() verdict to stderr; True when the lists are equivalent"""
+    mismatches = verify_ranges(raw, compressed)
+    for version, level in mismatches:
+        print(f"VERIFY FAILED: IPv{version} /{level} routes differ between raw and compressed lists", file=sys.stderr)
+    if not mismatches:
+        print(f"VERIFY OK: {len(raw)} raw entries -> {len(compressed)} compressed entries, "
+              f"identical at every prefix length", file=sys.stderr)
+    return not mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress a prefix list into an exactly equivalent ge/le list")
+    parser.add_argument("-f", "--file", help="Read entries from FILE instead of stdin")
+    parser.add_argument("--le4", type=int, help="Bare IPv4 prefixes shorter than N also permit more specifics up to N")
+    parser.add_argument("--le6", type=int, help="Bare IPv6 prefixes shorter than N also permit more specifics up to N")
+    parser.add_argument("--format", choices=["plain", "vyos", "junos", "brocade"], default="plain", help="Output format (default: plain RPSL ranges)")
+    parser.add_argument("--name", default="PL-CHANGE-MY-NAME", help="Prefix-list name for vyos, junos and brocade output")
+    parser.add_argument("--no-compress", action="store_true", help="Render the raw list as is")
+    parser.add_argument("--verify", action="store_true", help="Prove the compressed list permits exactly the routes of the raw list")
+    args = parser.parse_args()
+
+    with (open(args.file) if args.file else sys.stdin) as f:
+        lines = [line.split("#", 1)[0].strip() for line in f]
+
+    raw = []
+    for line in lines:
+        if not line:
+            continue
+        try:
+            raw.append(parse_entry(line))
+        except ValueError as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            sys.exit(1)
+    raw = list(with_le(raw, args.le4, args.le6))
+
+    ranges = raw if args.no_compress else compress_ranges(raw)
+    print("\n".join(render(ranges, args.format, args.name)))
+
+    if args.verify and not report_verification(raw, ranges):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
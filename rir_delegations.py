@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Offline RIR attribution for IP prefixes.
+
+Loads the five RIRs' delegated-extended statistics files into a sorted
+interval index so RIR, status and country can be answered for any number
+of prefixes without a single whois query.  The files are cached in
+~/.workdir-irr-toolbox/delegated and refreshed once a day; the parsed index
+is pickled next to them and only rebuilt when one of the files changes.
+
+Usage: rir_delegations.py [-f <prefix_file>] [--refresh] [--debug] [prefix ...]
+       (prefixes are read from stdin when none are given)
+
+Output is one line per prefix: prefix|RIR|STATUS|CC
+Prefixes not covered by any delegation are printed with empty fields.
+"""
+
+import os
+import sys
+import time
+import pickle
+import argparse
+import ipaddress
+import urllib.request
+from bisect import bisect_right
+
+# === Configuration ===
+OUTPUT_DIR = os.path.expanduser("~/.workdir-irr-toolbox")
+DELEGATED_DIR = os.path.join(OUTPUT_DIR, "delegated")
+DELEGATED_TTL = 86400  # 24 hours
+INDEX_PATH = os.path.join(DELEGATED_DIR, "delegated-index.pickle")
+INDEX_VERSION = 1
+USER_AGENT_FILE = os.path.expanduser("~/.bgp-tools-useragent")
+
+DELEGATED_SOURCES = {
+    "AFRINIC": "https://ftp.afrinic.net/pub/stats/afrinic/delegated-afrinic-extended-latest",
+    "APNIC": "https://ftp.apnic.net/stats/apnic/delegated-apnic-extended-latest",
+    "ARIN": "https://ftp.arin.net/pub/stats/arin/delegated-arin-extended-latest",
+    "LACNIC": "https://ftp.lacnic.net/pub/stats/lacnic/delegated-lacnic-extended-latest",
+    "RIPE": "https://ftp.ripe.net/pub/stats/ripencc/delegated-ripencc-extended-latest",
+}
+
+# registry field as written in the stats files -> name used throughout irr-toolbox
+REGISTRY_NAMES = {
+    "afrinic": "AFRINIC",
+    "apnic": "APNIC",
+    "arin": "ARIN",
+    "lacnic": "LACNIC",
+    "ripencc": "RIPE",
+}
+
+
+def debug_print(debug, msg):
+    if debug:
+        print(f"+DEBUG: {msg}", file=sys.stderr)
+
+
+def get_user_agent():
+    try:
+        with open(USER_AGENT_FILE, "r") as f:
+            agent = f.read().strip()
+            if agent:
+                return agent
+    except Exception:
+        pass
+    return "irr-toolbox delegated stats fetcher"
+
+
+def delegated_path(rir):
+    return os.path.join(DELEGATED_DIR, f"delegated-{rir.lower()}-extended-latest")
+
+
+def fetch_delegations(refresh=False, debug=False):
+    """Download any missing or stale delegated-extended file; returns {rir: path} of usable files"""
+    os.makedirs(DELEGATED_DIR, exist_ok=True)
+    paths = {}
+    now = time.time()
+
+    for rir, url in DELEGATED_SOURCES.items():
+        path = delegated_path(rir)
+        exists = os.path.exists(path)
+        age = now - os.path.getmtime(path) if exists else None
+
+        if refresh or not exists or age > DELEGATED_TTL:
+            debug_print(debug, f"Downloading {rir} delegated stats from {url}")
+            try:
+                req = urllib.request.Request(url, headers={"User-Agent": get_user_agent()})
+                tmp_path = f"{path}.tmp"
+                with urllib.request.urlopen(req, timeout=60) as response, open(tmp_path, "wb") as out_file:
+                    out_file.write(response.read())
+                os.replace(tmp_path, path)
+                exists = True
+            except Exception as e:
+                # A stale file is still far better than no attribution at all
+                debug_print(debug, f"Failed to download {rir} delegated stats: {e}")
+        else:
+            debug_print(debug, f"{rir} delegated stats are fresh ({int(age)}s old)")
+
+        if exists:
+            paths[rir] = path
+
+    return paths
+
+
+def parse_delegations(paths, debug=False):
+    """Parse delegated-extended files into sorted (starts, ends, records) tables per address family"""
+    rows = {"ipv4": [], "ipv6": []}
+    records = {}
+
+    for rir, path in paths.items():
+        count = 0
+        with open(path, "r", errors="replace") as f:
+            for line in f:
+                if not line or line[0] == "#":
+                    continue
+                parts = line.rstrip("\n").split("|")
+                # header and summary lines are shorter or carry '*' in the cc/start fields
+                if len(parts) < 7 or parts[2] not in rows or parts[3] == "*":
+                    continue
+                registry, cc, family, start, value, _date, status = parts[:7]
+                try:
+                    if family == "ipv4":
+                        first = int(ipaddress.IPv4Address(start))
+                        last = first + int(value) - 1
+                    else:
+                        first = int(ipaddress.IPv6Address(start))
+                        last = first + (1 << (128 - int(value))) - 1
+                except ValueError:
+                    continue
+                key = (REGISTRY_NAMES.get(registry, registry.upper()), status.upper(), cc.upper())
+                rec = records.setdefault(key, key)  # share identical tuples
+                rows[family].append((first, last, rec))
+                count += 1
+        debug_print(debug, f"Parsed {count} delegations from {path}")
+
+    index = {}
+    for family, entries in rows.items():
+        entries.sort(key=lambda r: r[0])
+        index[family] = (
+            [r[0] for r in entries],
+            [r[1] for r in entries],
+            [r[2] for r in entries],
+        )
+    return index
+
+
+def load_index(refresh=False, debug=False):
+    """Return the delegation index, rebuilding the pickled copy only when a stats file changed"""
+    paths = fetch_delegations(refresh=refresh, debug=debug)
+    mtimes = {rir: os.path.getmtime(path) for rir, path in paths.items()}
+
+    if os.path.exists(INDEX_PATH):
+        try:
+            with open(INDEX_PATH, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("version") == INDEX_VERSION and cached.get("mtimes") == mtimes:
+                debug_print(debug, f"Loaded delegation index from {INDEX_PATH}")
+                return cached["index"]
+        except Exception as e:
+            debug_print(debug, f"Ignoring unreadable delegation index {INDEX_PATH}: {e}")
+
+    index = parse_delegations(paths, debug=debug)
+    try:
+        tmp_path = f"{INDEX_PATH}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": INDEX_VERSION, "mtimes": mtimes, "index": index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, INDEX_PATH)
+    except Exception as e:
+        debug_print(debug, f"Failed to write delegation index {INDEX_PATH}: {e}")
+    return index
+
+
+def lookup(index, prefix):
+    """Return (rir, status, cc) for the delegation holding prefix, or None"""
+    return lookup_many(index, [prefix]).get(prefix)
+
+
+def lookup_many(index, prefixes):
+    """
+    Attribute many prefixes in one sorted sweep over the index.
+    Returns {prefix: (rir, status, cc) or None}; unparseable prefixes map to None.
+    """
+    results = {}
+    parsed = {"ipv4": [], "ipv6": []}
+
+    for prefix in prefixes:
+        try:
+            net = ipaddress.ip_network(prefix, strict=False)
+        except ValueError:
+            results[prefix] = None
+            continue
+        family = "ipv4" if net.version == 4 else "ipv6"
+        parsed[family].append((int(net.network_address), prefix))
+
+    for family, items in parsed.items():
+        starts, ends, recs = index.get(family, ([], [], []))
+        items.sort()
+        lo = 0
+        for first, prefix in items:
+            # inputs are sorted, so the search window only ever moves forward
+            i = bisect_right(starts, first, lo) - 1
+            if i >= 0 and ends[i] >= first:
+                results[prefix] = recs[i]
+                lo = i
+            else:
+                results[prefix] = None
+                lo = max(i, 0)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attribute prefixes to RIRs using local delegated-extended stats")
+    parser.add_argument("prefixes", nargs="*", help="Prefixes to attribute (default: read from stdin)")
+    parser.add_argument("-f", "--prefix-file", help="File containing prefixes, one per line")
+    parser.add_argument("--refresh", action="store_true", help="Re-download delegated stats regardless of age")
+    parser.add_argument("--debug", action="store_true", help="Enable debug output")
+    args = parser.parse_args()
+
+    prefixes = list(args.prefixes)
+    if args.prefix_file:
+        with open(args.prefix_file, "r") as f:
+            prefixes.extend(line.strip() for line in f if line.strip())
+    elif not prefixes:
+        prefixes = [line.strip() for line in sys.stdin if line.strip()]
+
+    index = load_index(refresh=args.refresh, debug=args.debug)
+    results = lookup_many(index, prefixes)
+
+    for prefix in prefixes:
+        rir, status, cc = results.get(prefix) or ("", "", "")
+        print(f"{prefix}|{rir}|{status}|{cc}")
+
+
+if __name__ == "__main__":
+    main()
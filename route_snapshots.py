@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Delta-encoded route snapshot store.
+
+Each snapshot key (a router/neighbor pair, or an audited prefix set) is one
+append-only file in ~/.workdir-irr-toolbox/snapshots.  A snapshot maps
+prefix -> path state (an AS path, or a list of AS paths for multi-collector
+data).  Every recorded snapshot is written as a delta against the previous
+one: added, withdrawn and path-changed prefixes, each change carrying the
+previous value so deltas can be composed without loading a full table.
+Full keyframes are written periodically only so the latest state can be
+rebuilt without replaying the whole history.
+
+History is kept for RETENTION_DAYS: once a keyframe is older than that,
+everything before the newest such keyframe is dropped by rewriting the
+file from that keyframe on and renaming it into place.  Snapshots within
+the window can still be diffed; the file stays bounded by the window
+instead of growing with every hourly snapshot.
+
+Record layout: 1-byte kind (F=full, D=delta), 8-byte timestamp, 4-byte
+payload length, then a zlib-compressed JSON payload with path values
+interned into a per-record table.
+
+Usage: route_snapshots.py list
+       route_snapshots.py history <key>
+       route_snapshots.py diff <key> [--last N | --since "YYYY-MM-DD HH:MM"]
+       route_snapshots.py prune [key ...] [--days N]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import struct
+import argparse
+import datetime
+
+# === Configuration ===
+OUTPUT_DIR = os.path.expanduser("~/.workdir-irr-toolbox")
+SNAPSHOT_DIR = os.path.join(OUTPUT_DIR, "snapshots")
+KEYFRAME_INTERVAL = 168     # at most one week of hourly deltas between keyframes
+RETENTION_DAYS = 90         # 0 keeps every snapshot
+HEADER = struct.Struct(">cdI")
+FULL = b"F"
+DELTA = b"D"
+ABSENT = object()
+
+
+def snapshot_path(key):
+    return os.path.join(SNAPSHOT_DIR, re.sub(r"[^A-Za-z0-9._-]", "_", key) + ".snap")
+
+
+def freeze(value):
+    """JSON gives back lists; turn nested lists into tuples so values compare and hash"""
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def scan_headers(path):
+    """Return [(offset, kind, ts, length)] without decompressing any payload"""
+    headers = []
+    if not os.path.exists(path):
+        return headers
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        while True:
+            offset = f.tell()
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size or offset + HEADER.size + HEADER.unpack(header)[2] > size:
+                return headers
+            kind, ts, length = HEADER.unpack(header)
+            headers.append((offset, kind, ts, length))
+            f.seek(length, os.SEEK_CUR)
+
+
+def read_payload(path, offset):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        kind, ts, length = HEADER.unpack(f.read(HEADER.size))
+        return json.loads(zlib.decompress(f.read(length)))
+
+
+def append_record(path, kind, ts, payload):
+    data = zlib.compress(json.dumps(payload, separators=(",", ":")).encode())
+    with open(path, "ab") as f:
+        f.write(HEADER.pack(kind, ts, len(data)) + data)
+    return HEADER.size + len(data)
+
+
+class ValueTable:
+    """Interns path values so each distinct path is written once per record"""
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def intern(self, value):
+        vid = self.ids.get(value)
+        if vid is None:
+            vid = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return vid
+
+
+def apply_delta(state, payload):
+    values = [freeze(v) for v in payload["values"]]
+    for prefix, vid in payload["added"]:
+        state[prefix] = values[vid]
+    for prefix, _old in payload["withdrawn"]:
+        state.pop(prefix, None)
+    for prefix, _old, new in payload["changed"]:
+        state[prefix] = values[new]
+
+
+def load_state(key):
+    """Rebuild the latest snapshot: last keyframe plus the deltas written after it"""
+    path = snapshot_path(key)
+    headers = scan_headers(path)
+    keyframes = [h for h in headers if h[1] == FULL]
+    if not keyframes:
+        return {}, None
+
+    offset, _kind, ts, _length = keyframes[-1]
+    payload = read_payload(path, offset)
+    values = [freeze(v) for v in payload["values"]]
+    state = {prefix: values[vid] for prefix, vid in payload["routes"]}
+    for d_offset, kind, d_ts, _length in headers:
+        if d_offset > offset and kind == DELTA:
+            apply_delta(state, read_payload(path, d_offset))
+            ts = d_ts
+    return state, ts
+
+
+def prune_snapshots(key, days=RETENTION_DAYS, now=None):
+    """
+    Drop the records before the newest keyframe older than `days`; that
+    keyframe becomes the file's first record.  Returns the bytes freed.
+    """
+    path = snapshot_path(key)
+    if days <= 0:
+        return 0
+    cutoff = (now or time.time()) - days * 86400
+    headers = scan_headers(path)
+    offsets = [offset for offset, kind, ts, _length in headers if kind == FULL and ts <= cutoff]
+    if not offsets or offsets[-1] == 0:
+        return 0
+    end = headers[-1][0] + HEADER.size + headers[-1][3]
+    with open(path, "rb") as f:
+        f.seek(offsets[-1])
+        data = f.read(end - offsets[-1])
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+    return offsets[-1]
+
+
+def record_snapshot(key, routes, ts=None, retention_days=RETENTION_DAYS):
+    """
+    Store routes ({prefix: path state}) as the newest snapshot for key,
+    pruning history older than retention_days.
+    Returns the changes against the previous snapshot as
+    {"added": {prefix: new}, "withdrawn": {prefix: old}, "changed": {prefix: (old, new)}, "since": ts}
+    or None when this is the first snapshot for key.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = snapshot_path(key)
+    ts = ts or time.time()
+    routes = {prefix: freeze(value) for prefix, value in routes.items()}
+    previous, previous_ts = load_state(key)
+
+    if previous_ts is None:
+        write_keyframe(path, ts, routes)
+        return None
+
+    table = ValueTable()
+    added, withdrawn, changed = {}, {}, {}
+    for prefix, value in routes.items():
+        old = previous.get(prefix, ABSENT)
+        if old is ABSENT:
+            added[prefix] = value
+        elif old != value:
+            changed[prefix] = (old, value)
+    for prefix, old in previous.items():
+        if prefix not in routes:
+            withdrawn[prefix] = old
+
+    payload = {
+        "added": [[p, table.intern(v)] for p, v in sorted(added.items())],
+        "withdrawn": [[p, table.intern(v)] for p, v in sorted(withdrawn.items())],
+        "changed": [[p, table.intern(o), table.intern(n)] for p, (o, n) in sorted(changed.items())],
+    }
+    payload["values"] = table.values
+    delta_size = append_record(path, DELTA, ts, payload)
+
+    # Keyframe once enough deltas have piled up that replaying them costs more than a full read
+    headers = scan_headers(path)
+    last_full = max(i for i, h in enumerate(headers) if h[1] == FULL)
+    since_full = headers[last_full + 1:]
+    if len(since_full) >= KEYFRAME_INTERVAL or sum(h[3] for h in since_full) > headers[last_full][3]:
+        write_keyframe(path, ts, routes)
+    prune_snapshots(key, retention_days, ts)
+
+    return {"added": added, "withdrawn": withdrawn, "changed": changed, "since": previous_ts, "bytes": delta_size}
+
+
+def write_keyframe(path, ts, routes):
+    table = ValueTable()
+    rows = [[prefix, table.intern(value)] for prefix, value in sorted(routes.items())]
+    return append_record(path, FULL, ts, {"values": table.values, "routes": rows})
+
+
+def changes_since(key, since=None, last=1):
+    """
+    Net changes between the snapshot at or before `since` (epoch seconds) and
+    the latest one, composed from the deltas alone.  Without `since`, covers
+    the last `last` snapshots.  Same result shape as record_snapshot().
+    """
+    path = snapshot_path(key)
+    deltas = [h for h in scan_headers(path) if h[1] == DELTA]
+    if since is None:
+        deltas = deltas[-last:] if last > 0 else []
+    else:
+        deltas = [h for h in deltas if h[2] > since]
+
+    net = {}    # prefix -> [value before the window, latest value]
+    start_ts = None
+    for offset, _kind, ts, _length in deltas:
+        payload = read_payload(path, offset)
+        values = [freeze(v) for v in payload["values"]]
+        for prefix, vid in payload["added"]:
+            net.setdefault(prefix, [ABSENT, None])[1] = values[vid]
+        for prefix, old in payload["withdrawn"]:
+            net.setdefault(prefix, [values[old], None])[1] = ABSENT
+        for prefix, old, new in payload["changed"]:
+            net.setdefault(prefix, [values[old], None])[1] = values[new]
+
+    if deltas:
+        headers = scan_headers(path)
+        first = deltas[0][0]
+        earlier = [h[2] for h in headers if h[0] < first]
+        start_ts = earlier[-1] if earlier else None
+
+    added, withdrawn, changed = {}, {}, {}
+    for prefix, (before, after) in net.items():
+        if before is ABSENT and after is not ABSENT:
+            added[prefix] = after
+        elif before is not ABSENT and after is ABSENT:
+            withdrawn[prefix] = before
+        elif before is not ABSENT and before != after:
+            changed[prefix] = (before, after)
+    return {"added": added, "withdrawn": withdrawn, "changed": changed, "since": start_ts}
+
+
+def format_ts(ts):
+    return datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else "never"
+
+
+def format_value(value):
+    if value and isinstance(value[0], tuple):
+        return " | ".join(" ".join(str(asn) for asn in path) for path in value)
+    return " ".join(str(asn) for asn in value)
+
+
+def print_changes(changes, indent=""):
+    for prefix, new in sorted(changes["added"].items()):
+        print(f"{indent}[{'ADDED'.center(16)}]   {prefix:<23} {format_value(new)}")
+    for prefix, old in sorted(changes["withdrawn"].items()):
+        print(f"{indent}[{'WITHDRAWN'.center(16)}]   {prefix:<23} {format_value(old)}")
+    for prefix, (old, new) in sorted(changes["changed"].items()):
+        print(f"{indent}[{'PATH_CHANGED'.center(16)}]   {prefix:<23} {format_value(old)}")
+        print(f"{indent}{'':<20}   {'->':<23} {format_value(new)}")
+
+
+def summarize_changes(changes):
+    return (f"{len(changes['added'])} added, {len(changes['withdrawn'])} withdrawn, "
+            f"{len(changes['changed'])} path-changed since {format_ts(changes['since'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect delta-encoded route snapshots")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="List snapshot keys")
+    history = sub.add_parser("history", help="List snapshots recorded for a key")
+    history.add_argument("key")
+    diff = sub.add_parser("diff", help="Show added, withdrawn and path-changed prefixes")
+    diff.add_argument("key")
+    diff.add_argument("--last", type=int, default=1, help="Number of most recent snapshots to cover (default 1)")
+    diff.add_argument("--since", help="Cover everything after this time (YYYY-MM-DD HH:MM)")
+    prune = sub.add_parser("prune", help="Drop history older than the retention window")
+    prune.add_argument("keys", nargs="*", help="Snapshot keys (default: all)")
+    prune.add_argument("--days", type=int, default=RETENTION_DAYS, help=f"Retention window in days (default {RETENTION_DAYS})")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        if os.path.isdir(SNAPSHOT_DIR):
+            for name in sorted(os.listdir(SNAPSHOT_DIR)):
+                if name.endswith(".snap"):
+                    size = os.path.getsize(os.path.join(SNAPSHOT_DIR, name))
+                    print(f"{name[:-5]:<60} {size:>12} bytes")
+        return
+
+    if args.command == "prune":
+        keys = args.keys
+        if not keys and os.path.isdir(SNAPSHOT_DIR):
+            keys = [name[:-5] for name in sorted(os.listdir(SNAPSHOT_DIR)) if name.endswith(".snap")]
+        for key in keys:
+            freed = prune_snapshots(key, args.days)
+            if freed:
+                print(f"{key:<60} {freed:>12} bytes freed")
+        return
+
+    path = snapshot_path(args.key)
+    if not os.path.exists(path):
+        print(f"ERROR: No snapshots found for {args.key}")
+        sys.exit(1)
+
+    if args.command == "history":
+        # later keyframes repeat the snapshot of the delta just before them; only the first one is a snapshot
+        for offset, kind, ts, length in scan_headers(path):
+            if kind == FULL and offset > 0:
+                continue
+            print(f"{format_ts(ts)}  {'full' if kind == FULL else 'delta':<8} {length:>10} bytes")
+        return
+
+    since = datetime.datetime.fromisoformat(args.since).timestamp() if args.since else None
+    changes = changes_since(args.key, since=since, last=args.last)
+    print(summarize_changes(changes))
+    print_changes(changes)
+
+
+if __name__ == "__main__":
+    main()
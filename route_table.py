@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Compact, column-oriented IPv4 route table.
+
+Routes are stored as parallel array columns instead of a Python object per
+route: the prefix packed as (int network, length), plus ids into shared
+tables of interned AS paths and community sets.  A full table shares a few
+hundred thousand distinct paths across a million routes, so each route
+costs ~17 bytes of columns instead of a tuple, a string and a list.
+
+Usage: route_table.py [--bench N]
+       (reports memory per route for N synthetic routes, default 1000000)
+"""
+
+import sys
+import socket
+import struct
+import random
+import argparse
+import tracemalloc
+from array import array
+
+_unpack_ip = struct.Struct(">I").unpack
+
+
+def pack_prefix(prefix):
+    """'192.0.2.0/24' -> (3221225984, 24); host bits are cleared"""
+    addr, _, length = prefix.partition("/")
+    length = int(length) if length else 32
+    if not 0 <= length <= 32:
+        raise ValueError(f"invalid IPv4 prefix length: {prefix}")
+    try:
+        net = _unpack_ip(socket.inet_aton(addr))[0]
+    except OSError:
+        raise ValueError(f"invalid IPv4 prefix: {prefix}")
+    mask = (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF
+    return net & mask, length
+
+
+def unpack_prefix(net, length):
+    return f"{socket.inet_ntoa(struct.pack('>I', net))}/{length}"
+
+
+class RouteTable:
+    """Routes as array columns; AS paths and community sets are interned and referenced by id"""
+    __slots__ = ("nets", "lens", "path_ids", "comm_ids", "sources",
+                 "paths", "path_index", "communities", "comm_index")
+
+    def __init__(self):
+        self.nets = array("I")
+        self.lens = array("B")
+        self.path_ids = array("I")
+        self.comm_ids = array("I")
+        self.sources = array("I")   # source/collector ASN, 0 when unknown
+        self.paths = []
+        self.path_index = {}
+        self.communities = []
+        self.comm_index = {}
+        self.intern_communities(())
+
+    def intern_path(self, path):
+        path = tuple(path)
+        pid = self.path_index.get(path)
+        if pid is None:
+            pid = self.path_index[path] = len(self.paths)
+            self.paths.append(path)
+        return pid
+
+    def intern_communities(self, communities):
+        communities = tuple(communities)
+        cid = self.comm_index.get(communities)
+        if cid is None:
+            cid = self.comm_index[communities] = len(self.communities)
+            self.communities.append(communities)
+        return cid
+
+    def add(self, prefix, path, communities=(), source=0):
+        net, length = pack_prefix(prefix)
+        self.nets.append(net)
+        self.lens.append(length)
+        self.path_ids.append(self.intern_path(path))
+        self.comm_ids.append(self.intern_communities(communities))
+        self.sources.append(source)
+
+    def __len__(self):
+        return len(self.nets)
+
+    def prefix(self, i):
+        return unpack_prefix(self.nets[i], self.lens[i])
+
+    def path(self, i):
+        return self.paths[self.path_ids[i]]
+
+    def __iter__(self):
+        """Yield (prefix, path) per route, like the old list of tuples"""
+        paths = self.paths
+        for i, pid in enumerate(self.path_ids):
+            yield self.prefix(i), paths[pid]
+
+    def prefixes(self):
+        return {unpack_prefix(net, length) for net, length in set(zip(self.nets, self.lens))}
+
+    def prefix_groups(self):
+        """Yield (prefix, [row, ...]) in address order, one group per distinct prefix"""
+        groups = {}
+        for i, key in enumerate(zip(self.nets, self.lens)):
+            groups.setdefault(key, []).append(i)
+        for key in sorted(groups):
+            yield unpack_prefix(*key), groups[key]
+
+    def to_json_dict(self):
+        """The {prefix: [{source_asn, as_path, communities}]} layout of bgp-tools.json"""
+        return {
+            prefix: [{
+                "source_asn": self.sources[i],
+                "as_path": list(self.paths[self.path_ids[i]]),
+                "communities": list(self.communities[self.comm_ids[i]]),
+            } for i in rows]
+            for prefix, rows in self.prefix_groups()
+        }
+
+    def memory_usage(self):
+        """Approximate bytes held by the table: columns plus interned tables"""
+        columns = sum(col.itemsize * len(col) for col in (self.nets, self.lens, self.path_ids, self.comm_ids, self.sources))
+        interned = sys.getsizeof(self.paths) + sys.getsizeof(self.path_index)
+        interned += sum(sys.getsizeof(p) + sum(sys.getsizeof(asn) for asn in p) for p in self.paths)
+        interned += sys.getsizeof(self.communities) + sys.getsizeof(self.comm_index)
+        interned += sum(sys.getsizeof(c) + sum(sys.getsizeof(s) for s in c) for c in self.communities)
+        return columns + interned
+
+
+def synthetic_routes(count, distinct_paths=None, seed=1):
+    """Full-table-like routes: /16-/24 prefixes sharing a limited pool of AS paths and communities"""
+    rng = random.Random(seed)
+    distinct_paths = distinct_paths or max(1, count // 4)
+    pool = [[rng.randrange(1, 400000) for _ in range(rng.randrange(2, 8))] for _ in range(distinct_paths)]
+    comm_pool = [[f"{rng.randrange(1, 65535)}:{rng.randrange(1, 65535)}" for _ in range(rng.randrange(0, 4))] for _ in range(1000)]
+    for _ in range(count):
+        length = rng.randrange(16, 25)
+        net = rng.randrange(16777216, 3758096384) & ((0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF)
+        yield net, length, rng.choice(pool), rng.choice(comm_pool), rng.randrange(1, 400000)
+
+
+def bench(count):
+    routes = list(synthetic_routes(count))
+
+    tracemalloc.start()
+    # the previous representations: analyze-bgp-routes.py's list of (str, list[int]) and
+    # check_transit_advertisement.py's dict of lists of dicts
+    legacy_list = [(unpack_prefix(net, length), list(path)) for net, length, path, _, _ in routes]
+    list_bytes = tracemalloc.get_traced_memory()[0]
+    del legacy_list
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    legacy_dict = {}
+    for net, length, path, comms, source in routes:
+        legacy_dict.setdefault(unpack_prefix(net, length), []).append({"source_asn": source, "as_path": list(path), "communities": list(comms)})
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    del legacy_dict
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    table = RouteTable()
+    for net, length, path, comms, source in routes:
+        table.add(unpack_prefix(net, length), path, comms, source)
+    table_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"Routes                       : {count}")
+    print(f"Distinct AS paths            : {len(table.paths)}")
+    print(f"list of (str, list[int])     : {list_bytes / count:8.1f} bytes/route")
+    print(f"dict of lists of dicts       : {dict_bytes / count:8.1f} bytes/route")
+    print(f"RouteTable                   : {table_bytes / count:8.1f} bytes/route")
+    print(f"RouteTable.memory_usage()    : {table.memory_usage() / count:8.1f} bytes/route")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact route table memory benchmark")
+    parser.add_argument("--bench", type=int, default=1000000, metavar="N", help="Number of synthetic routes (default 1000000)")
+    args = parser.parse_args()
+    bench(args.bench)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+RPSL set expansion: as-sets, route-sets and filter-sets.
+
+Set objects form a graph (sets referencing sets, ASNs standing for the
+routes they originate).  The graph is either fetched from an IRRd whois
+server with fetch_set_graph(), every distinct object queried once with
+several queries in flight, or built from a local object store (see
+nrtm_watch.py).  expand_set() then walks it locally.  Prefix ranges are
+kept as (network, lo, hi): all more specifics of network with a length
+between lo and hi, which is what the RPSL ^+, ^-, ^n and ^n-m operators
+describe (RFC 2622, section 5).
+"""
+
+import re
+import socket
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+AUTNUM_RE = re.compile(r"^AS\d+$")
+RANGE_OP_RE = re.compile(r"^(\+|-|\d+|\d+-\d+)$")
+FILTER_TOKEN_RE = re.compile(r"\{[^}]*\}(?:\^[-+\d]+)?|<[^>]*>|\(|\)|[^\s(){}<>]+")
+COMMUNITY_RE = re.compile(r"community(?:\.\w+)?\s*\([^)]*\)", re.IGNORECASE)
+ANY_SETS = ("RS-ANY", "AS-ANY")     # RFC 2622 sets standing for every route; there is no object to fetch
+
+
+class FilterError(ValueError):
+    """A filter term cannot be expressed as prefix ranges; any list built without it would be wrong"""
+
+
+class QueryError(OSError):
+    """IRR queries for part of a set graph failed; an expansion without those objects would be truncated"""
+
+
+def set_class(name):
+    """RPSL class of a (possibly hierarchical) set name, e.g. AS65000:RS-CUSTOMERS -> route-set"""
+    for part in name.upper().split(":"):
+        for prefix, cls in (("RS-", "route-set"), ("FLTR-", "filter-set"), ("AS-", "as-set")):
+            if part.startswith(prefix):
+                return cls
+    return None
+
+
+def member_key(name):
+    """(class, NAME) for a set or aut-num reference, None for anything else (including RS-ANY / AS-ANY)"""
+    name = name.upper()
+    if name in ANY_SETS:
+        return None
+    if AUTNUM_RE.match(name):
+        return ("aut-num", name)
+    cls = set_class(name)
+    return (cls, name) if cls else None
+
+
+def split_range_op(token):
+    """'192.0.2.0/24^+' -> ('192.0.2.0/24', '+'); a missing or malformed operator gives None"""
+    base, _, op = token.partition("^")
+    return base, (op if RANGE_OP_RE.match(op) else None)
+
+
+def irr_query(host, query, timeout=30):
+    """Send one IRRd '!' query to host:43; returns the response data, "" for no data, None when not found (D); ValueError otherwise"""
+    data = b""
+    with socket.create_connection((host, 43), timeout=timeout) as sock:
+        sock.sendall(f"{query}\n".encode())
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+            if data.startswith(b"A"):
+                header, newline, rest = data.partition(b"\n")
+                if newline and len(rest) >= int(header[1:]) + 2:
+                    break
+            elif data.endswith(b"\n"):
+                break
+
+    if data.startswith(b"A"):
+        header, _, rest = data.partition(b"\n")
+        return rest[:int(header[1:])].decode(errors="replace")
+    if data.startswith(b"C"):
+        return ""
+    if data.startswith(b"D"):
+        return None
+    raise ValueError(f"unexpected reply to {query}: {data[:60].decode(errors='replace').strip() or 'nothing'}")
+
+
+def rpsl_attributes(text):
+    """[(attribute, value)] with continuation lines folded in and comments stripped"""
+    attrs = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].rstrip()
+        if not line:
+            continue
+        if line[0] in " \t+" and attrs:
+            attrs[-1] = (attrs[-1][0], f"{attrs[-1][1]} {line.lstrip(' +').strip()}")
+        elif ":" in line:
+            attr, _, value = line.partition(":")
+            attrs.append((attr.strip().lower(), value.strip()))
+    return attrs
+
+
+def parse_set_object(cls, text):
+    """RPSL text of an as-set, route-set or filter-set -> (value, [referenced keys]) for expand_set()"""
+    attrs = rpsl_attributes(text)
+
+    if cls in ("as-set", "route-set"):
+        members = [
+            member.strip()
+            for attr, value in attrs if attr in ("members", "mp-members")
+            for member in value.split(",") if member.strip()
+        ]
+        refs = [member_key(split_range_op(m)[0]) for m in members]
+        return members, [ref for ref in refs if ref]
+
+    # filter-set: filter (IPv4) and mp-filter are alternatives, so OR them together
+    filters = [value for attr, value in attrs if attr in ("filter", "mp-filter")]
+    expression = " OR ".join(f"( {f} )" for f in filters)
+    tokens = FILTER_TOKEN_RE.findall(COMMUNITY_RE.sub("<community>", expression))
+    refs = [member_key(split_range_op(t)[0]) for t in tokens if not t.startswith(("{", "<", "(", ")"))]
+    return tokens, [ref for ref in refs if ref]
+
+
+def fetch_irr_object(host, key):
+    """Fetch one graph node; returns (value, [referenced keys])"""
+    cls, name = key
+    if cls == "aut-num":
+        # route (!g) and route6 (!6) objects, as the nrtm_watch.py store links both to an aut-num
+        prefixes = []
+        for query in (f"!g{name}", f"!6{name}"):
+            prefixes += (irr_query(host, query) or "").split()
+        return prefixes, []
+
+    if cls == "as-set":
+        # IRRd resolves nested as-sets server side
+        text = irr_query(host, f"!i{name},1")
+        if text is None:
+            return None, []
+        asns = [asn.upper() for asn in text.split() if AUTNUM_RE.match(asn.upper())]
+        return asns, [("aut-num", asn) for asn in asns]
+
+    text = irr_query(host, f"!m{cls},{name}")
+    if text is None:
+        return None, []
+    return parse_set_object(cls, text)
+
+
+def fetch_set_graph(host, root, workers=8, debug=False):
+    """
+    Fetch root and everything it references, breadth first, with up to
+    `workers` queries in flight.  Each key is queried once no matter how
+    many sets reference it.  Returns {key: value}; raises QueryError when
+    any query failed.
+    """
+    objects = {}
+    queued = set()
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        def submit(key):
+            if key not in queued:
+                queued.add(key)
+                pending[pool.submit(fetch_irr_object, host, key)] = key
+
+        submit(root)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    value, refs = future.result()
+                except (OSError, ValueError) as e:
+                    failures.append(f"{key[0]} {key[1]}: {e}")
+                    value, refs = None, []
+                objects[key] = value
+                for ref in refs:
+                    submit(ref)
+
+    if failures:
+        raise QueryError(f"{len(failures)} IRR quer{'y' if len(failures) == 1 else 'ies'} to {host} failed ({'; '.join(failures)})")
+    if debug:
+        print(f"[DEBUG] Fetched {len(objects)} distinct objects from {host} for {root[1]}")
+    return objects
+
+
+def any_ranges():
+    """Every IPv4 and IPv6 route"""
+    return {(ipaddress.ip_network(n), 0, ipaddress.ip_network(n).max_prefixlen) for n in ("0.0.0.0/0", "::/0")}
+
+
+def op_bounds(op, length, max_length):
+    if op == "+":
+        return length, max_length
+    if op == "-":
+        return length + 1, max_length
+    lo, _, hi = op.partition("-")
+    return int(lo), int(hi or lo)
+
+
+def apply_range_op(items, op):
+    """
+    Apply a range operator to every (network, lo, hi) in items.  A bare
+    prefix takes the operator as is; a prefix that already carries one is
+    narrowed to the overlap, so {30.0.0.0/8^24-28}^27-30 is 30.0.0.0/8^27-28.
+    """
+    if op is None:
+        return set(items)
+    result = set()
+    for net, lo, hi in items:
+        length, max_length = net.prefixlen, net.max_prefixlen
+        op_lo, op_hi = op_bounds(op, length, max_length)
+        if (lo, hi) != (length, length):
+            op_lo, op_hi = max(lo, op_lo), min(hi, op_hi)
+        op_lo = max(op_lo, length)
+        if op_lo <= op_hi <= max_length:
+            result.add((net, op_lo, op_hi))
+    return result
+
+
+def intersect_ranges(left, right):
+    """Exact intersection of two prefix range sets: a range meets another only inside the more specific prefix"""
+    def by_prefix(items):
+        index = {}
+        for net, lo, hi in items:
+            index.setdefault(net, []).append((lo, hi))
+        return index
+
+    result = set()
+    for items, other, strict in ((left, by_prefix(right), False), (right, by_prefix(left), True)):
+        for net, lo, hi in items:
+            for length in range(net.prefixlen - strict, -1, -1):
+                for o_lo, o_hi in other.get(net.supernet(new_prefix=length) if length < net.prefixlen else net, ()):
+                    if max(lo, o_lo) <= min(hi, o_hi):
+                        result.add((net, max(lo, o_lo), min(hi, o_hi)))
+    return result
+
+
+def subtract_range(items, excluded):
+    """
+    Exact difference of a prefix range set and one range.  A range whose
+    prefix is covered by the excluded prefix only loses lengths; one that
+    covers it keeps its other lengths whole, and for the excluded lengths
+    is split into the siblings along the path down to the excluded prefix.
+    """
+    e_net, e_lo, e_hi = excluded
+    result = set()
+    for net, lo, hi in items:
+        if net.version != e_net.version or not (net.subnet_of(e_net) or e_net.subnet_of(net)):
+            result.add((net, lo, hi))
+            continue
+        cut_lo, cut_hi = max(lo, e_lo, e_net.prefixlen), min(hi, e_hi)
+        if cut_lo > cut_hi:
+            result.add((net, lo, hi))
+            continue
+        if lo < cut_lo:
+            result.add((net, lo, cut_lo - 1))
+        if cut_hi < hi:
+            result.add((net, cut_hi + 1, hi))
+        if net.prefixlen < e_net.prefixlen:
+            for length in range(net.prefixlen + 1, e_net.prefixlen + 1):
+                ancestor = e_net.supernet(new_prefix=length)
+                parent = ancestor.supernet()
+                sibling = next(half for half in parent.subnets() if half != ancestor)
+                result.add((sibling, cut_lo, cut_hi))
+    return result
+
+
+def subtract_ranges(items, excluded):
+    for rng in excluded:
+        items = subtract_range(items, rng)
+    return items
+
+
+def parse_prefix_item(token):
+    """'10.0.0.0/8^+' -> {(10.0.0.0/8, 8, 32)}, or None when the token is not a prefix"""
+    base, op = split_range_op(token)
+    try:
+        net = ipaddress.ip_network(base, strict=False)
+    except ValueError:
+        return None
+    return apply_range_op({(net, net.prefixlen, net.prefixlen)}, op)
+
+
+def expand_set(objects, key, warnings, _memo=None, _stack=()):
+    """Expand a fetched graph node into a set of (network, lo, hi) prefix ranges"""
+    memo = {} if _memo is None else _memo
+    if key in memo:
+        return memo[key]
+    if key in _stack:
+        warnings.append(f"{key[1]} references itself via {' -> '.join(k[1] for k in _stack)}, loop ignored")
+        return set()
+
+    cls, name = key
+    value = objects.get(key)
+    stack = _stack + (key,)
+    items = set()
+    if value is None:
+        warnings.append(f"{cls} {name} not found")
+    elif cls == "aut-num":
+        items = {i for p in value for i in (parse_prefix_item(p) or ())}
+    elif cls == "as-set":
+        # members are ASNs, plus nested as-sets when the graph was not resolved server side
+        for member in value:
+            if member.upper() in ANY_SETS:
+                items |= any_ranges()
+                continue
+            ref = member_key(member)
+            if ref and ref[0] in ("aut-num", "as-set"):
+                items |= expand_set(objects, ref, warnings, memo, stack)
+    elif cls == "route-set":
+        for member in value:
+            base, op = split_range_op(member)
+            ref = member_key(base)
+            if base.upper() in ANY_SETS:
+                warnings.append(f"{name} member {member} matches every route")
+                items |= apply_range_op(any_ranges(), op)
+            elif ref:
+                items |= apply_range_op(expand_set(objects, ref, warnings, memo, stack), op)
+            else:
+                member_items = parse_prefix_item(member)
+                if member_items is None:
+                    warnings.append(f"{name} member {member} not understood, skipped")
+                items |= member_items or set()
+    else:
+        items = FilterParser(objects, name, value, warnings, memo, stack).parse()
+
+    memo[key] = items
+    return items
+
+
+class FilterParser:
+    """
+    Recursive descent over an RPSL filter expression (OR / AND / NOT,
+    parentheses, { } prefix sets and set or ASN references; juxtaposition
+    is OR).  NOT is an exact range difference, against the other terms of
+    its AND or against every route.  AS path regexes, community matches and
+    other terms that are not prefix ranges raise FilterError: dropping one
+    would widen or narrow the list without anyone noticing.
+    """
+    def __init__(self, objects, name, tokens, warnings, memo, stack):
+        self.objects, self.name, self.tokens = objects, name, tokens
+        self.warnings, self.memo, self.stack = warnings, memo, stack
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos].upper() if self.pos < len(self.tokens) else None
+
+    def next(self):
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def parse(self):
+        items = self.parse_or()
+        if self.peek() is not None:
+            raise FilterError(f"{self.name} filter has unparsed trailing terms from '{self.tokens[self.pos]}'")
+        return items
+
+    def parse_or(self):
+        items = self.parse_and()
+        while self.peek() not in (None, ")", "AND"):
+            if self.peek() == "OR":
+                self.next()
+            items = items | self.parse_and()
+        return items
+
+    def parse_and(self):
+        """X AND NOT Y AND Z: intersect the plain terms, then subtract the negated ones"""
+        included, excluded = None, set()
+        while True:
+            negated, items = self.parse_not()
+            if negated:
+                excluded |= items
+            else:
+                included = items if included is None else intersect_ranges(included, items)
+            if self.peek() != "AND":
+                break
+            self.next()
+        return subtract_ranges(any_ranges() if included is None else included, excluded)
+
+    def parse_not(self):
+        """(negated, items); NOT NOT X is X"""
+        if self.peek() != "NOT":
+            return False, self.parse_primary()
+        self.next()
+        start = self.pos
+        # a negated term that lost anything (missing object, loop) would widen the result, so
+        # expand it afresh: memoised sets would not repeat the warnings that show it is incomplete
+        warnings, memo = self.warnings, self.memo
+        self.warnings, self.memo = [], {}
+        try:
+            negated, items = self.parse_not()
+        finally:
+            term_warnings, self.warnings, self.memo = self.warnings, warnings, memo
+        if term_warnings:
+            raise FilterError(f"{self.name} filter term NOT {' '.join(self.tokens[start:self.pos])} is incomplete "
+                              f"({'; '.join(term_warnings)})")
+        return not negated, items
+
+    def parse_primary(self):
+        if self.peek() in (None, ")"):
+            return set()
+        token = self.next()
+        if token == "(":
+            items = self.parse_or()
+            if self.peek() == ")":
+                self.next()
+            return items
+        if token.startswith("{"):
+            body, _, op = token.partition("}")
+            items = set()
+            for member in body.strip("{ ").split(","):
+                if member.strip():
+                    items |= parse_prefix_item(member.strip()) or set()
+            return apply_range_op(items, split_range_op(op)[1] if op else None)
+        base, op = split_range_op(token)
+        if token.upper() == "ANY" or base.upper() in ANY_SETS:
+            return apply_range_op(any_ranges(), op)
+        ref = member_key(base)
+        if ref:
+            return apply_range_op(expand_set(self.objects, ref, self.warnings, self.memo, self.stack), op)
+        raise FilterError(f"{self.name} filter term {token} is not a prefix set or set reference and cannot be expanded")
+
+
+def expand_rpsl_set(host, name, workers=8, debug=False):
+    """Expand a route-set or filter-set; returns (sorted [(network, lo, hi)], warnings)"""
+    key = member_key(name)
+    objects = fetch_set_graph(host, key, workers, debug)
+    warnings = []
+    items = expand_set(objects, key, warnings)
+    return sorted(items, key=lambda i: (i[0].version, i[0], i[1], i[2])), warnings
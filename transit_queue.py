@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Work queue for check_transit_advertisement.py runs.
+
+Every audit is a run with an explicit run ID.  Its prefixes are rows in a
+SQLite queue (default ~/.workdir-irr-toolbox/transit-queue.db); workers
+claim one prefix at a time inside a BEGIN IMMEDIATE transaction, so any
+number of worker processes - on this host, or on other hosts when the
+queue sits on shared storage with working POSIX locks - never query the
+same prefix twice.  Each finished prefix is checkpointed with its raw
+bgp.tools capture, so an interrupted run resumes where it stopped and the
+report can be built from the queue alone.
+
+A claim is a lease: claims older than CLAIM_LEASE seconds, or held by a
+process on this host that no longer exists, go back to pending.  Hosts
+without shared storage each audit a static --shard of the prefixes into a
+local queue; the finished captures are then merged into one queue.
+
+Usage: transit_queue.py list [--queue DB]
+       transit_queue.py merge <dest DB> <source DB> [...] [--run-id ID]
+"""
+
+import os
+import sys
+import time
+import zlib
+import socket
+import sqlite3
+import argparse
+
+# === Configuration ===
+OUTPUT_DIR = os.path.expanduser("~/.workdir-irr-toolbox")
+QUEUE_DB = os.path.join(OUTPUT_DIR, "transit-queue.db")
+CLAIM_LEASE = 900       # a prefix query takes ~10s; a claim this old belongs to a dead worker
+MAX_ATTEMPTS = 3
+LOCK_TIMEOUT = 120
+
+# Row states: pending -> claimed -> done, or back to pending on error until
+# MAX_ATTEMPTS is reached (failed).  remote rows belong to another shard.
+STATES = ("pending", "claimed", "done", "failed", "remote")
+
+
+def worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def worker_alive(worker):
+    """False only for a worker on this host whose process is gone; other hosts are left to the lease"""
+    host, _, pid = worker.rpartition("-")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    return pid_alive(int(pid))
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def shard_of(prefix, count):
+    """Static shard (0-based) of a prefix; independent of prefix list order, so every host agrees"""
+    return zlib.crc32(prefix.encode()) % count
+
+
+# === Queue ===
+
+def open_queue(path=QUEUE_DB):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # autocommit: every write below takes the lock explicitly with BEGIN IMMEDIATE
+    db = sqlite3.connect(path, timeout=LOCK_TIMEOUT, isolation_level=None)
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, target_asn INTEGER, source TEXT, created REAL);
+        CREATE TABLE IF NOT EXISTS work (
+            run_id TEXT, prefix TEXT, status TEXT, worker TEXT, claimed_at REAL,
+            attempts INTEGER DEFAULT 0, finished_at REAL, error TEXT, output TEXT,
+            PRIMARY KEY (run_id, prefix));
+        CREATE INDEX IF NOT EXISTS work_status ON work (run_id, status);
+    """)
+    return db
+
+
+class locked:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on error; holds the queue's write lock throughout"""
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def get_run(db, run_id):
+    row = db.execute("SELECT run_id, target_asn, source, created FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+    return dict(zip(("run_id", "target_asn", "source", "created"), row)) if row else None
+
+
+def create_run(db, run_id, target_asn, source, prefixes, shard=None):
+    """
+    Enqueue prefixes under run_id; shard=(index, count) marks the prefixes of
+    other shards remote.  Returns False, changing nothing, when the run exists.
+    """
+    now = time.time()
+    with locked(db):
+        if db.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone():
+            return False
+        db.execute("INSERT INTO runs (run_id, target_asn, source, created) VALUES (?, ?, ?, ?)",
+                   (run_id, target_asn, source, now))
+        db.executemany(
+            "INSERT OR IGNORE INTO work (run_id, prefix, status) VALUES (?, ?, ?)",
+            ((run_id, prefix, "remote" if shard and shard_of(prefix, shard[1]) != shard[0] else "pending")
+             for prefix in prefixes))
+    return True
+
+
+def latest_unfinished_run(db, target_asn):
+    row = db.execute("""
+        SELECT runs.run_id FROM runs JOIN work ON work.run_id = runs.run_id
+        WHERE runs.target_asn = ? AND work.status IN ('pending', 'claimed', 'failed')
+        ORDER BY runs.created DESC LIMIT 1
+    """, (target_asn,)).fetchone()
+    return row[0] if row else None
+
+
+def run_prefixes(db, run_id, *statuses):
+    """Prefixes of a run in queue order, optionally only those in the given states"""
+    query = "SELECT prefix FROM work WHERE run_id = ?"
+    if statuses:
+        query += f" AND status IN ({', '.join('?' * len(statuses))})"
+    return [prefix for (prefix,) in db.execute(query + " ORDER BY rowid", (run_id, *statuses))]
+
+
+def release_dead_claims(db, run_id):
+    """Return prefixes claimed by workers that died on this host to pending; returns the count"""
+    claims = db.execute("SELECT prefix, worker FROM work WHERE run_id = ? AND status = 'claimed'", (run_id,)).fetchall()
+    dead = [(run_id, prefix, worker) for prefix, worker in claims if not worker_alive(worker)]
+    if dead:
+        with locked(db):
+            db.executemany("UPDATE work SET status = 'pending', worker = NULL, attempts = attempts - 1 "
+                           "WHERE run_id = ? AND prefix = ? AND worker = ? AND status = 'claimed'", dead)
+    return len(dead)
+
+
+def release_worker(db, run_id, worker):
+    """Hand back everything a worker still has claimed (on interrupt); an interrupt is not a failed attempt"""
+    with locked(db):
+        db.execute("UPDATE work SET status = 'pending', worker = NULL, attempts = attempts - 1 "
+                   "WHERE run_id = ? AND worker = ? AND status = 'claimed'", (run_id, worker))
+
+
+def retry_failed(db, run_id):
+    with locked(db):
+        return db.execute("UPDATE work SET status = 'pending', attempts = 0, error = NULL "
+                          "WHERE run_id = ? AND status = 'failed'", (run_id,)).rowcount
+
+
+def claim_prefix(db, run_id, worker, lease=CLAIM_LEASE):
+    """Atomically take the next pending (or lease-expired) prefix; None when nothing is left to claim"""
+    now = time.time()
+    with locked(db):
+        row = db.execute("""
+            SELECT prefix FROM work
+            WHERE run_id = ? AND (status = 'pending' OR (status = 'claimed' AND claimed_at < ?))
+            ORDER BY rowid LIMIT 1
+        """, (run_id, now - lease)).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE work SET status = 'claimed', worker = ?, claimed_at = ?, attempts = attempts + 1 "
+                   "WHERE run_id = ? AND prefix = ?", (worker, now, run_id, row[0]))
+    return row[0]
+
+
+def complete_prefix(db, run_id, prefix, output):
+    """Checkpoint a prefix with its raw capture"""
+    with locked(db):
+        db.execute("UPDATE work SET status = 'done', finished_at = ?, error = NULL, output = ? "
+                   "WHERE run_id = ? AND prefix = ?", (time.time(), output, run_id, prefix))
+
+
+def fail_prefix(db, run_id, prefix, error):
+    with locked(db):
+        db.execute("UPDATE work SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                   "worker = NULL, error = ? WHERE run_id = ? AND prefix = ?",
+                   (MAX_ATTEMPTS, error, run_id, prefix))
+
+
+def run_progress(db, run_id):
+    counts = dict.fromkeys(STATES, 0)
+    counts.update(db.execute("SELECT status, COUNT(*) FROM work WHERE run_id = ? GROUP BY status", (run_id,)).fetchall())
+    return counts
+
+
+def run_results(db, run_id):
+    """Yield (prefix, capture) for every finished prefix of a run"""
+    yield from db.execute("SELECT prefix, output FROM work WHERE run_id = ? AND status = 'done' ORDER BY rowid", (run_id,))
+
+
+def merge_queue(db, source_path, run_id=None):
+    """
+    Copy finished prefixes (of run_id, or of every run) from another queue
+    into this one, creating runs that are missing here.  Prefixes already
+    done here are kept.  Returns the number of prefixes taken over.
+    """
+    db.execute("ATTACH DATABASE ? AS source", (source_path,))
+    try:
+        run_filter = "run_id = ?" if run_id else "1"
+        params = (run_id,) if run_id else ()
+        with locked(db):
+            db.execute(f"INSERT OR IGNORE INTO runs SELECT * FROM source.runs WHERE {run_filter}", params)
+            return db.execute(f"""
+                INSERT INTO work (run_id, prefix, status, worker, claimed_at, attempts, finished_at, error, output)
+                SELECT run_id, prefix, status, worker, claimed_at, attempts, finished_at, error, output
+                FROM source.work WHERE status = 'done' AND {run_filter}
+                ON CONFLICT (run_id, prefix) DO UPDATE SET
+                    status = excluded.status, worker = excluded.worker, claimed_at = excluded.claimed_at,
+                    attempts = excluded.attempts, finished_at = excluded.finished_at,
+                    error = NULL, output = excluded.output
+                WHERE work.status != 'done'
+            """, params).rowcount
+    finally:
+        db.execute("DETACH DATABASE source")
+
+
+def format_progress(counts):
+    total = sum(counts.values())
+    parts = [f"{counts['done']}/{total} done"]
+    parts += [f"{counts[state]} {state}" for state in ("claimed", "pending", "failed", "remote") if counts[state]]
+    return ", ".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and merge transit audit work queues")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("list", help="List runs and their progress")
+    p.add_argument("--queue", default=QUEUE_DB, help=f"Queue database (default {QUEUE_DB})")
+    p = sub.add_parser("merge", help="Copy finished prefixes from other queues into one")
+    p.add_argument("dest")
+    p.add_argument("sources", nargs="+")
+    p.add_argument("--run-id", help="Only merge this run")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        if not os.path.exists(args.queue):
+            print(f"ERROR: No queue at {args.queue}")
+            sys.exit(1)
+        db = open_queue(args.queue)
+        for run_id, target_asn, source, created in db.execute("SELECT run_id, target_asn, source, created FROM runs ORDER BY created"):
+            started = time.strftime("%Y-%m-%d %H:%M", time.localtime(created))
+            print(f"{run_id:<32} AS{target_asn:<10} {started}  {source:<24} {format_progress(run_progress(db, run_id))}")
+        return
+
+    db = open_queue(args.dest)
+    for source in args.sources:
+        if not os.path.exists(source):
+            print(f"ERROR: No queue at {source}")
+            sys.exit(1)
+        print(f"{source}: {merge_queue(db, source, args.run_id)} prefix(es) merged")
+
+
+if __name__ == "__main__":
+    main()